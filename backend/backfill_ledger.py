@@ -0,0 +1,43 @@
+"""
+Rebuild tenant ledgers and balances from rent payments, e.g. for payments recorded before the ledger existed.
+
+Each tenant is rebuilt in one transaction on a replica set. On a standalone mongod run it with payment
+writes paused: a payment written while its tenant is being rebuilt can be posted twice.
+
+    python backfill_ledger.py [--portfolio-id default]
+"""
+
+import asyncio
+from typing import Optional
+
+import typer
+
+from server import PORTFOLIO_ID_PATTERN, db, detect_transactions, rebuild_ledger
+
+async def backfill(portfolio_id: Optional[str]):
+    if not await detect_transactions():
+        typer.echo("MongoDB is standalone; rebuilds are not atomic, make sure payment writes are paused")
+    match = {"portfolio_id": portfolio_id} if portfolio_id else {}
+    tenants = db.rent_payments.aggregate([
+        {"$match": match},
+        {"$group": {"_id": {"portfolio_id": "$portfolio_id", "tenant_id": "$tenant_id"}}},
+    ], allowDiskUse=True)
+    rebuilt = 0
+    async for row in tenants:
+        balance = await rebuild_ledger(row["_id"]["portfolio_id"], row["_id"]["tenant_id"])
+        rebuilt += 1
+        if rebuilt % 1000 == 0:
+            typer.echo(f"rebuilt {rebuilt} tenant ledgers")
+        if balance.balance < 0:
+            typer.echo(f"{balance.portfolio_id}/{balance.tenant_id}: overpaid by {-balance.balance:.2f}")
+    typer.echo(f"rebuilt {rebuilt} tenant ledgers")
+
+def main(
+    portfolio_id: Optional[str] = typer.Option(None, help="Only rebuild this portfolio (default: all)"),
+):
+    if portfolio_id and not PORTFOLIO_ID_PATTERN.match(portfolio_id):
+        raise typer.BadParameter("Invalid portfolio id")
+    asyncio.run(backfill(portfolio_id))
+
+if __name__ == "__main__":
+    typer.run(main)
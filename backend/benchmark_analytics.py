@@ -0,0 +1,108 @@
+"""
+Time /api/analytics over a large single portfolio: every year live, all but the last year closed,
+and every year closed.
+
+Defaults seed ten years of monthly rent for 10,000 units (1.2M payments) into a scratch database.
+
+    python benchmark_analytics.py --units 10000 --years 10
+"""
+
+import asyncio
+import random
+import shutil
+import statistics
+import time
+import tracemalloc
+import uuid
+from datetime import datetime
+
+import typer
+
+import server
+
+PORTFOLIO_ID = "benchmark"
+INSERT_BATCH = 10000
+
+async def seed(units: int, start_year: int, end_year: int):
+    expense_types = [expense_type.value for expense_type in server.ExpenseType]
+    payments, expenses = [], []
+    for year in range(start_year, end_year + 1):
+        for unit in range(units):
+            tenant_id = f"tenant-{unit}"
+            for month in range(1, 13):
+                status = random.choices(["paid", "partial", "unpaid"], weights=[90, 5, 5])[0]
+                payments.append({
+                    "id": uuid.uuid4().hex, "portfolio_id": PORTFOLIO_ID, "tenant_id": tenant_id,
+                    "apartment_id": f"apartment-{unit}", "amount": 1000.0,
+                    "amount_paid": {"paid": 1000.0, "partial": 400.0, "unpaid": 0.0}[status],
+                    "due_date": f"{year}-{month:02d}-01",
+                    "paid_date": f"{year}-{month:02d}-03" if status != "unpaid" else None,
+                    "status": status,
+                })
+            for _ in range(2):
+                expenses.append({
+                    "id": uuid.uuid4().hex, "portfolio_id": PORTFOLIO_ID, "expense_type": random.choice(expense_types),
+                    "amount": 150.0, "description": "Benchmark",
+                    "date": f"{year}-{random.randint(1, 12):02d}-15",
+                })
+            if len(payments) >= INSERT_BATCH:
+                await server.db.rent_payments.insert_many(payments)
+                payments = []
+        await server.db.expenses.insert_many(expenses)
+        expenses = []
+    if payments:
+        await server.db.rent_payments.insert_many(payments)
+    await server.db.tenants.insert_many([{
+        "id": f"tenant-{unit}", "portfolio_id": PORTFOLIO_ID, "monthly_rent": 1000.0,
+        "lease_start": f"{start_year}-01-01", "lease_end": f"{end_year + 1}-12-31",
+    } for unit in range(units)])
+
+async def measure(label: str, start_year: int, end_year: int, repeats: int):
+    timings = []
+    tracemalloc.start()
+    for _ in range(repeats):
+        start = time.perf_counter()
+        await server.get_analytics(start_year, end_year, 3, 12, PORTFOLIO_ID)
+        timings.append((time.perf_counter() - start) * 1000)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    typer.echo(f"{label:>10} {statistics.median(timings):>8.1f} {max(timings):>8.1f} {peak / 2**20:>10.1f}")
+
+async def run(units: int, years: int, repeats: int, close: bool, db_name: str):
+    server.db = server.client[db_name]
+    await server.client.drop_database(db_name)
+    await server.create_indexes()
+    end_year = datetime.now().year - 1
+    start_year = end_year - years + 1
+    try:
+        seed_start = time.perf_counter()
+        await seed(units, start_year, end_year)
+        payments = await server.db.rent_payments.estimated_document_count()
+        typer.echo(f"seeded {payments} payments in {time.perf_counter() - seed_start:.0f}s")
+        typer.echo(f"{'source':>10} {'p50 ms':>8} {'max ms':>8} {'peak MiB':>10}")
+        await measure("live", start_year, end_year, repeats)
+        if close:
+            # The usual shape: closed history plus the year still being written to
+            for year in range(start_year, end_year):
+                await server.close_year(year, True, PORTFOLIO_ID)
+            await measure("1 open", start_year, end_year, repeats)
+            await server.close_year(end_year, True, PORTFOLIO_ID)
+            await measure("snapshot", start_year, end_year, repeats)
+    finally:
+        await server.client.drop_database(db_name)
+        if close:
+            shutil.rmtree(server.ARCHIVE_DIR / PORTFOLIO_ID, ignore_errors=True)
+
+def main(
+    units: int = typer.Option(10000, help="Units (one payment per unit per month)"),
+    years: int = typer.Option(10, help="Years of history ending last year"),
+    repeats: int = typer.Option(5, help="Timed analytics calls per source"),
+    close: bool = typer.Option(True, help="Also close every year and time the snapshot path"),
+    db_name: str = typer.Option("analytics_benchmark", help="Scratch database, dropped before and after"),
+):
+    if close:
+        server.ARCHIVE_DIR = server.ARCHIVE_DIR.parent / "archive_benchmark"
+    asyncio.run(run(units, years, repeats, close, db_name))
+
+if __name__ == "__main__":
+    typer.run(main)
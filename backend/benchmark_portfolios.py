@@ -0,0 +1,106 @@
+"""
+Show that report latency depends on one portfolio's size, not on the total dataset.
+
+Seeds a scratch database with an increasing number of identical portfolios and
+times the dashboard, yearly report and analytics for a sample of them at each size.
+The examined column is totalDocsExamined for one month of a portfolio's payments;
+it should stay flat as portfolios are added.
+
+    python benchmark_portfolios.py --portfolios 1000 --units 10
+"""
+
+import asyncio
+import random
+import statistics
+import time
+import uuid
+from datetime import datetime
+
+import typer
+
+import server
+
+async def seed_portfolio(portfolio_id: str, units: int, year: int):
+    apartments, tenants, payments, expenses = [], [], [], []
+    for unit in range(units):
+        apartment = server.Apartment(
+            portfolio_id=portfolio_id, unit_number=str(unit), address="Benchmark St",
+            bedrooms=2, bathrooms=1, monthly_rent=1000, deposit=1000
+        )
+        tenant = server.Tenant(
+            portfolio_id=portfolio_id, first_name="Bench", last_name=str(unit), email="bench@example.com",
+            phone="555", apartment_id=apartment.id, lease_start=f"{year}-01-01", lease_end=f"{year + 1}-12-31",
+            monthly_rent=1000, deposit_paid=1000
+        )
+        apartments.append(apartment.dict())
+        tenants.append(tenant.dict())
+        for month in range(1, 13):
+            status = random.choice(list(server.RentStatus))
+            payments.append(server.RentPayment(
+                portfolio_id=portfolio_id, tenant_id=tenant.id, apartment_id=apartment.id, amount=1000,
+                due_date=f"{year}-{month:02d}-01", paid_date=f"{year}-{month:02d}-03", status=status,
+                amount_paid={server.RentStatus.PAID: 1000, server.RentStatus.PARTIAL: 400}.get(status, 0)
+            ).dict())
+    for month in range(1, 13):
+        for expense_type in random.sample(list(server.ExpenseType), 2):
+            expenses.append(server.Expense(
+                portfolio_id=portfolio_id, expense_type=expense_type, amount=100,
+                description="Benchmark", date=f"{year}-{month:02d}-15"
+            ).dict())
+    await server.db.apartments.insert_many(apartments)
+    await server.db.tenants.insert_many(tenants)
+    await server.db.rent_payments.insert_many(payments)
+    await server.db.expenses.insert_many(expenses)
+
+async def time_portfolio(portfolio_id: str, year: int) -> float:
+    start = time.perf_counter()
+    await server.get_dashboard(portfolio_id)
+    await server.get_yearly_report(year, portfolio_id)
+    await server.get_analytics(year, year, 3, 12, portfolio_id)
+    return (time.perf_counter() - start) * 1000
+
+async def docs_examined(portfolio_id: str, year: int) -> int:
+    explain = await server.db.command("explain", {
+        "find": "rent_payments",
+        "filter": {"portfolio_id": portfolio_id, "paid_date": {"$gte": f"{year}-01-01", "$lt": f"{year}-02-01"}},
+    }, verbosity="executionStats")
+    return explain["executionStats"]["totalDocsExamined"]
+
+async def run(portfolios: int, units: int, samples: int, db_name: str):
+    server.db = server.client[db_name]
+    await server.client.drop_database(db_name)
+    await server.create_indexes()
+    year = datetime.now().year
+    portfolio_ids = []
+    checkpoints = sorted({size for size in (1, 10, 100, portfolios) if size <= portfolios})
+
+    typer.echo(f"{'portfolios':>10} {'documents':>10} {'examined':>8} {'p50 ms':>8} {'p95 ms':>8}")
+    try:
+        for checkpoint in checkpoints:
+            while len(portfolio_ids) < checkpoint:
+                portfolio_id = uuid.uuid4().hex[:12]
+                await seed_portfolio(portfolio_id, units, year)
+                portfolio_ids.append(portfolio_id)
+            documents = sum([
+                await server.db[collection].estimated_document_count()
+                for collection in ("apartments", "tenants", "rent_payments", "expenses")
+            ])
+            timings = sorted([
+                await time_portfolio(random.choice(portfolio_ids), year) for _ in range(samples)
+            ])
+            p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+            examined = await docs_examined(random.choice(portfolio_ids), year)
+            typer.echo(f"{checkpoint:>10} {documents:>10} {examined:>8} {statistics.median(timings):>8.1f} {p95:>8.1f}")
+    finally:
+        await server.client.drop_database(db_name)
+
+def main(
+    portfolios: int = typer.Option(1000, help="Total number of portfolios to seed"),
+    units: int = typer.Option(10, help="Apartments per portfolio"),
+    samples: int = typer.Option(20, help="Timed portfolios per checkpoint"),
+    db_name: str = typer.Option("portfolio_benchmark", help="Scratch database, dropped before and after"),
+):
+    asyncio.run(run(portfolios, units, samples, db_name))
+
+if __name__ == "__main__":
+    typer.run(main)
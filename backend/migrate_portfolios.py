@@ -0,0 +1,68 @@
+"""
+Assign existing data to a portfolio and rebuild indexes with portfolio_id leading.
+
+    python migrate_portfolios.py --portfolio-id default [--shard]
+"""
+
+import asyncio
+import shutil
+
+import typer
+from pymongo.errors import OperationFailure
+
+from server import ARCHIVE_DIR, DEFAULT_PORTFOLIO_ID, PORTFOLIO_ID_PATTERN, SHARD_KEYS, client, create_indexes, db
+
+# Single-tenant indexes created before partitioning
+LEGACY_INDEXES = {
+    "rent_payments": ["due_date_1", "paid_date_1"],
+    "expenses": ["date_1"],
+    "tenants": ["lease_end_1"],
+    "ledger_entries": ["tenant_id_1_sequence_-1"],
+    "tenant_balances": ["tenant_id_1", "balance_1"],
+    # TTL index that expired outbox events whether or not they had been consumed
+    "events": ["created_at_1"],
+}
+
+async def migrate(portfolio_id: str, shard: bool):
+    for collection in SHARD_KEYS:
+        result = await db[collection].update_many(
+            {"portfolio_id": {"$exists": False}}, {"$set": {"portfolio_id": portfolio_id}}
+        )
+        typer.echo(f"{collection}: assigned {result.modified_count} documents to {portfolio_id}")
+
+    for collection, index_names in LEGACY_INDEXES.items():
+        for index_name in index_names:
+            try:
+                await db[collection].drop_index(index_name)
+                typer.echo(f"{collection}: dropped {index_name}")
+            except OperationFailure:
+                pass
+    await create_indexes()
+
+    # Snapshots closed before partitioning sit directly under ARCHIVE_DIR/<year>
+    if ARCHIVE_DIR.exists():
+        for year_dir in ARCHIVE_DIR.glob("[0-9][0-9][0-9][0-9]"):
+            target = ARCHIVE_DIR / portfolio_id / year_dir.name
+            if not target.exists():
+                target.parent.mkdir(parents=True, exist_ok=True)
+                shutil.move(str(year_dir), str(target))
+                typer.echo(f"archive: moved {year_dir.name} to {portfolio_id}")
+
+    if shard:
+        await client.admin.command("enableSharding", db.name)
+        for collection, keys in SHARD_KEYS.items():
+            await client.admin.command(
+                "shardCollection", f"{db.name}.{collection}", key={key: 1 for key in keys}
+            )
+            typer.echo(f"{collection}: sharded on {keys}")
+
+def main(
+    portfolio_id: str = typer.Option(DEFAULT_PORTFOLIO_ID, help="Portfolio that owns pre-existing data"),
+    shard: bool = typer.Option(False, help="Also shard collections (requires a mongos connection)"),
+):
+    if not PORTFOLIO_ID_PATTERN.match(portfolio_id):
+        raise typer.BadParameter("Invalid portfolio id")
+    asyncio.run(migrate(portfolio_id, shard))
+
+if __name__ == "__main__":
+    typer.run(main)
@@ -0,0 +1,52 @@
+"""
+Replay dead-lettered outbox events through their consumer, e.g. after fixing the bug that made them fail.
+
+Events that succeed are removed from events_dead_letter; events that fail again stay with the new error.
+
+    python redrive_outbox.py [--consumer monthly_rollups] [--dry-run]
+"""
+
+import asyncio
+from datetime import datetime
+from typing import Optional
+
+import typer
+
+from server import OUTBOX_CONSUMERS, db
+
+async def redrive(consumer: Optional[str], dry_run: bool):
+    query = {"_id.consumer": consumer} if consumer else {}
+    redriven = failed = 0
+    async for parked in db.events_dead_letter.find(query).sort("failed_at", 1):
+        name, event = parked["_id"]["consumer"], parked["event"]
+        handler = OUTBOX_CONSUMERS.get(name)
+        if not handler:
+            typer.echo(f"{name}: no such consumer, skipping event {event['_id']}")
+            continue
+        if dry_run:
+            typer.echo(f"{name}: would redrive event {event['_id']} ({event['entity']} {event['action']})")
+            continue
+        try:
+            await handler([event])
+        except Exception as error:
+            await db.events_dead_letter.update_one(
+                {"_id": parked["_id"]},
+                {"$set": {"error": repr(error), "failed_at": datetime.utcnow()}, "$inc": {"redrives": 1}},
+            )
+            typer.echo(f"{name}: event {event['_id']} failed again: {error!r}")
+            failed += 1
+            continue
+        await db.events_dead_letter.delete_one({"_id": parked["_id"]})
+        redriven += 1
+    typer.echo(f"redrove {redriven} events, {failed} still failing")
+
+def main(
+    consumer: Optional[str] = typer.Option(None, help="Only redrive this consumer (default: all)"),
+    dry_run: bool = typer.Option(False, help="List the events without replaying them"),
+):
+    if consumer and consumer not in OUTBOX_CONSUMERS:
+        raise typer.BadParameter(f"Unknown consumer; expected one of {sorted(OUTBOX_CONSUMERS)}")
+    asyncio.run(redrive(consumer, dry_run))
+
+if __name__ == "__main__":
+    typer.run(main)
@@ -1,15 +1,27 @@
-from fastapi import FastAPI, APIRouter, HTTPException
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, Header
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from bson import ObjectId
 import os
+import re
+import json
+import shutil
+import zlib
+from collections import OrderedDict
+import asyncio
 import logging
 from pathlib import Path
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, model_validator
 from typing import List, Optional
 import uuid
-from datetime import datetime
+from datetime import datetime, timedelta
 from enum import Enum
+import numpy as np
+import pandas as pd
+import pyarrow as pa
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
@@ -19,12 +31,48 @@ mongo_url = os.environ['MONGO_URL']
 client = AsyncIOMotorClient(mongo_url)
 db = client[os.environ['DB_NAME']]
 
+# Every document belongs to one portfolio (landlord); requests must name it in the X-Portfolio-ID header
+# unless single-portfolio mode is enabled, in which case a missing header means the default portfolio
+DEFAULT_PORTFOLIO_ID = os.environ.get('DEFAULT_PORTFOLIO_ID', 'default')
+SINGLE_PORTFOLIO_MODE = os.environ.get('SINGLE_PORTFOLIO_MODE', 'false').lower() == 'true'
+PORTFOLIO_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+# Closed-year snapshots live on local disk
+ARCHIVE_DIR = Path(os.environ.get('ARCHIVE_DIR', ROOT_DIR / 'archive'))
+SNAPSHOT_CACHE_SIZE = int(os.environ.get('SNAPSHOT_CACHE_SIZE', 256))
+
+# Outbox: events are hashed by portfolio into partitions, each consumed by its own worker per consumer
+OUTBOX_ENABLED = os.environ.get('OUTBOX_ENABLED', 'true').lower() == 'true'
+OUTBOX_PARTITIONS = int(os.environ.get('OUTBOX_PARTITIONS', 4))
+OUTBOX_BATCH_SIZE = int(os.environ.get('OUTBOX_BATCH_SIZE', 500))
+OUTBOX_POLL_SECONDS = float(os.environ.get('OUTBOX_POLL_SECONDS', 0.5))
+# Workers only read events whose _id is older than the settle window; see _run_outbox_worker for the limits
+OUTBOX_SETTLE_SECONDS = float(os.environ.get('OUTBOX_SETTLE_SECONDS', 2))
+# Events every consumer has checkpointed past are deleted once older than this
+OUTBOX_RETENTION_DAYS = int(os.environ.get('OUTBOX_RETENTION_DAYS', 7))
+OUTBOX_PRUNE_SECONDS = float(os.environ.get('OUTBOX_PRUNE_SECONDS', 3600))
+# A batch that fails this many times in a row is retried event by event, and events that still fail are dead-lettered
+OUTBOX_MAX_ATTEMPTS = int(os.environ.get('OUTBOX_MAX_ATTEMPTS', 5))
+OUTBOX_MAX_BACKOFF_SECONDS = float(os.environ.get('OUTBOX_MAX_BACKOFF_SECONDS', 30))
+# Each (consumer, partition) is leased to one server process; a lease not renewed for this long can be taken over
+OUTBOX_LEASE_SECONDS = float(os.environ.get('OUTBOX_LEASE_SECONDS', 30))
+OUTBOX_OWNER = f"{os.uname().nodename}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+_supports_transactions = False
+
 # Create the main app without a prefix
 app = FastAPI()
 
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
 
+async def get_portfolio_id(x_portfolio_id: Optional[str] = Header(None)) -> str:
+    if not x_portfolio_id and not SINGLE_PORTFOLIO_MODE:
+        raise HTTPException(status_code=400, detail="X-Portfolio-ID header is required")
+    portfolio_id = x_portfolio_id or DEFAULT_PORTFOLIO_ID
+    if not PORTFOLIO_ID_PATTERN.match(portfolio_id):
+        raise HTTPException(status_code=400, detail="Invalid portfolio id")
+    return portfolio_id
+
 # Enums
 class RentStatus(str, Enum):
     PAID = "paid"
@@ -32,6 +80,10 @@ class RentStatus(str, Enum):
     OVERDUE = "overdue"
     PARTIAL = "partial"
 
+class LedgerEntryType(str, Enum):
+    CHARGE = "charge"
+    PAYMENT = "payment"
+
 class ExpenseType(str, Enum):
     MAINTENANCE = "maintenance"
     UTILITIES = "utilities"
@@ -43,6 +95,7 @@ class ExpenseType(str, Enum):
 # Models
 class Apartment(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    portfolio_id: str = DEFAULT_PORTFOLIO_ID
     unit_number: str
     address: str
     bedrooms: int
@@ -65,6 +118,7 @@ class ApartmentCreate(BaseModel):
 
 class Tenant(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    portfolio_id: str = DEFAULT_PORTFOLIO_ID
     first_name: str
     last_name: str
     email: str
@@ -93,12 +147,14 @@ class TenantCreate(BaseModel):
 
 class RentPayment(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    portfolio_id: str = DEFAULT_PORTFOLIO_ID
     tenant_id: str
     apartment_id: str
     amount: float
     due_date: str     # Changed from date to str for MongoDB compatibility
     paid_date: Optional[str] = None  # Changed from date to str for MongoDB compatibility
     status: RentStatus
+    amount_paid: Optional[float] = None  # Portion of amount actually received, set for partial payments
     payment_method: Optional[str] = None
     notes: Optional[str] = None
     created_at: datetime = Field(default_factory=datetime.utcnow)
@@ -110,11 +166,29 @@ class RentPaymentCreate(BaseModel):
     due_date: str     # Changed from date to str for MongoDB compatibility
     paid_date: Optional[str] = None  # Changed from date to str for MongoDB compatibility
     status: RentStatus = RentStatus.UNPAID
+    amount_paid: Optional[float] = None  # Defaults to amount when paid, 0 otherwise
     payment_method: Optional[str] = None
     notes: Optional[str] = None
 
+    @model_validator(mode="after")
+    def check_amount_paid(self):
+        if self.status == RentStatus.PARTIAL and self.amount_paid is None:
+            raise ValueError("amount_paid is required for partial payments")
+        if self.amount_paid is None:
+            return self
+        if not 0 <= self.amount_paid <= self.amount:
+            raise ValueError("amount_paid must be between 0 and amount")
+        if self.status == RentStatus.PAID and self.amount_paid != self.amount:
+            raise ValueError("amount_paid must equal amount for paid payments")
+        if self.status == RentStatus.PARTIAL and not 0 < self.amount_paid < self.amount:
+            raise ValueError("amount_paid must be more than 0 and less than amount for partial payments")
+        if self.status in (RentStatus.UNPAID, RentStatus.OVERDUE) and self.amount_paid != 0:
+            raise ValueError("amount_paid must be 0 for unpaid or overdue payments")
+        return self
+
 class Expense(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    portfolio_id: str = DEFAULT_PORTFOLIO_ID
     apartment_id: Optional[str] = None
     expense_type: ExpenseType
     amount: float
@@ -133,6 +207,34 @@ class ExpenseCreate(BaseModel):
     vendor: Optional[str] = None
     receipt_url: Optional[str] = None
 
+class LedgerEntry(BaseModel):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    portfolio_id: str = DEFAULT_PORTFOLIO_ID
+    tenant_id: str
+    payment_id: Optional[str] = None
+    sequence: int
+    entry_type: LedgerEntryType
+    amount: float     # Signed: negative amounts reverse an earlier entry
+    date: str
+    balance_after: float
+    description: Optional[str] = None
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+
+class TenantBalance(BaseModel):
+    portfolio_id: str = DEFAULT_PORTFOLIO_ID
+    tenant_id: str
+    total_charged: float = 0
+    total_paid: float = 0
+    balance: float = 0  # Amount owed: total_charged - total_paid
+    entry_count: int = 0
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
+
+class TenantLedger(BaseModel):
+    balance: TenantBalance
+    entries: List[LedgerEntry]
+    skip: int
+    limit: int
+
 class FinancialSummary(BaseModel):
     total_rental_income: float
     total_expenses: float
@@ -141,144 +243,403 @@ class FinancialSummary(BaseModel):
     month: str
     year: int
 
+# Ledger
+def _resolve_amount_paid(payment: RentPaymentCreate) -> float:
+    if payment.amount_paid is not None:
+        return payment.amount_paid
+    return payment.amount if payment.status == RentStatus.PAID else 0.0
+
+def _stored_amount_paid(payment: dict) -> float:
+    """amount_paid of a stored payment; ones recorded before the field existed count in full only when paid"""
+    amount_paid = payment.get("amount_paid")
+    if amount_paid is None:
+        amount_paid = payment["amount"] if payment["status"] == RentStatus.PAID.value else 0.0
+    return amount_paid
+
+async def _post_ledger_entry(portfolio_id: str, tenant_id: str, payment_id: Optional[str], entry_type: LedgerEntryType,
+                             amount: float, date: str, description: Optional[str] = None, session=None):
+    """Apply one entry to the materialized balance atomically, then record it with the resulting running balance"""
+    if not amount:
+        return
+    charged = amount if entry_type == LedgerEntryType.CHARGE else 0.0
+    paid = amount if entry_type == LedgerEntryType.PAYMENT else 0.0
+    balance = await db.tenant_balances.find_one_and_update(
+        {"portfolio_id": portfolio_id, "tenant_id": tenant_id},
+        {
+            "$inc": {"total_charged": charged, "total_paid": paid, "balance": charged - paid, "entry_count": 1},
+            "$set": {"updated_at": datetime.utcnow()},
+        },
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+        session=session,
+    )
+    entry = LedgerEntry(
+        portfolio_id=portfolio_id,
+        tenant_id=tenant_id,
+        payment_id=payment_id,
+        sequence=balance["entry_count"],
+        entry_type=entry_type,
+        amount=amount,
+        date=date,
+        balance_after=balance["balance"],
+        description=description,
+    )
+    await db.ledger_entries.insert_one(entry.dict(), session=session)
+
+async def _post_payment_to_ledger(payment: dict, sign: int = 1, session=None):
+    """Post (sign=1) or reverse (sign=-1) the charge and receipt of a stored rent payment"""
+    amount_paid = _stored_amount_paid(payment)
+    await _post_ledger_entry(payment["portfolio_id"], payment["tenant_id"], payment["id"], LedgerEntryType.CHARGE,
+                             sign * payment["amount"], payment["due_date"], f"Rent due {payment['due_date']}",
+                             session=session)
+    await _post_ledger_entry(payment["portfolio_id"], payment["tenant_id"], payment["id"], LedgerEntryType.PAYMENT,
+                             sign * amount_paid, payment.get("paid_date") or payment["due_date"], "Payment received",
+                             session=session)
+
+async def _update_payment_in_ledger(existing: dict, updated: dict, session=None):
+    """Post only the deltas of an edited payment, reversing fully if it moved to another tenant"""
+    if existing["tenant_id"] != updated["tenant_id"]:
+        await _post_payment_to_ledger(existing, sign=-1, session=session)
+        await _post_payment_to_ledger(updated, session=session)
+        return
+    old_paid = _stored_amount_paid(existing)
+    await _post_ledger_entry(updated["portfolio_id"], updated["tenant_id"], updated["id"], LedgerEntryType.CHARGE,
+                             updated["amount"] - existing["amount"], updated["due_date"], "Charge adjustment",
+                             session=session)
+    await _post_ledger_entry(updated["portfolio_id"], updated["tenant_id"], updated["id"], LedgerEntryType.PAYMENT,
+                             updated["amount_paid"] - old_paid, updated.get("paid_date") or updated["due_date"],
+                             "Payment adjustment", session=session)
+
+async def rebuild_ledger(portfolio_id: str, tenant_id: str) -> TenantBalance:
+    """Regenerate a tenant's ledger in one transaction where supported; payment writes touch the same balance
+    document, so a concurrent write conflicts with the rebuild and one of them is retried"""
+    async def write(session):
+        await db.ledger_entries.delete_many({"portfolio_id": portfolio_id, "tenant_id": tenant_id}, session=session)
+        await db.tenant_balances.delete_one({"portfolio_id": portfolio_id, "tenant_id": tenant_id}, session=session)
+        payments = db.rent_payments.find({"portfolio_id": portfolio_id, "tenant_id": tenant_id}, session=session)
+        async for payment in payments.sort("due_date", 1):
+            await _post_payment_to_ledger(payment, session=session)
+        balance = await db.tenant_balances.find_one(
+            {"portfolio_id": portfolio_id, "tenant_id": tenant_id}, {"_id": 0}, session=session
+        )
+        return TenantBalance(**(balance or {"portfolio_id": portfolio_id, "tenant_id": tenant_id}))
+    return await _run_mutation(write)
+
+# Outbox
+EVENT_DATE_FIELDS = ("due_date", "paid_date", "date")
+MONTH_PATTERN = re.compile(r"^\d{4}-(0[1-9]|1[0-2])$")
+
+async def _run_mutation(write):
+    """Run write(session), a write plus its outbox event, as one transaction where the deployment supports it.
+
+    with_transaction re-runs the callback on TransientTransactionError (e.g. write conflicts on a balance)
+    and retries the commit on UnknownTransactionCommitResult, so the callback must be safe to repeat.
+    Writes append their event last and commits are capped below the settle window, keeping the gap
+    between an event's _id and its commit short (see _run_outbox_worker).
+    """
+    if not _supports_transactions:
+        return await write(None)
+    async with await client.start_session() as session:
+        return await session.with_transaction(
+            write, max_commit_time_ms=int(OUTBOX_SETTLE_SECONDS * 500)
+        )
+
+def _check_open_years(portfolio_id: str, *documents):
+    """Reject writes dated inside a closed year; its snapshot and aggregates would otherwise go stale"""
+    years = {
+        int(document[field][:4]) for document in documents if document
+        for field in EVENT_DATE_FIELDS if (document.get(field) or "")[:4].isdigit()
+    }
+    for year in sorted(years):
+        if _load_snapshot(portfolio_id, year):
+            raise HTTPException(status_code=409, detail=f"Year {year} is closed")
+
+async def _append_event(session, portfolio_id: str, entity: str, entity_id: str, action: str, *documents):
+    """Record a compact change event; months lists the YYYY-MM buckets touched by the old and new versions.
+
+    Events are only written where they commit atomically with the change they describe; a standalone
+    mongod has no transactions and so no outbox.
+    """
+    if not _supports_transactions:
+        return
+    months = sorted({
+        document[field][:7] for document in documents if document
+        for field in EVENT_DATE_FIELDS if MONTH_PATTERN.match((document.get(field) or "")[:7])
+    })
+    await db.events.insert_one({
+        "portfolio_id": portfolio_id,
+        "partition": zlib.crc32(portfolio_id.encode()) % OUTBOX_PARTITIONS,
+        "entity": entity,
+        "entity_id": entity_id,
+        "action": action,
+        "months": months,
+        "created_at": datetime.utcnow(),
+    }, session=session)
+
 # Apartment CRUD
 @api_router.post("/apartments", response_model=Apartment)
-async def create_apartment(apartment: ApartmentCreate):
+async def create_apartment(apartment: ApartmentCreate, portfolio_id: str = Depends(get_portfolio_id)):
     apartment_dict = apartment.dict()
-    apartment_obj = Apartment(**apartment_dict)
-    await db.apartments.insert_one(apartment_obj.dict())
+    apartment_obj = Apartment(**apartment_dict, portfolio_id=portfolio_id)
+    async def write(session):
+        await db.apartments.insert_one(apartment_obj.dict(), session=session)
+        await _append_event(session, portfolio_id, "apartment", apartment_obj.id, "created")
+    await _run_mutation(write)
     return apartment_obj
 
 @api_router.get("/apartments", response_model=List[Apartment])
-async def get_apartments():
-    apartments = await db.apartments.find().to_list(1000)
+async def get_apartments(portfolio_id: str = Depends(get_portfolio_id)):
+    apartments = await db.apartments.find({"portfolio_id": portfolio_id}).to_list(1000)
     return [Apartment(**apt) for apt in apartments]
 
 @api_router.get("/apartments/{apartment_id}", response_model=Apartment)
-async def get_apartment(apartment_id: str):
-    apartment = await db.apartments.find_one({"id": apartment_id})
+async def get_apartment(apartment_id: str, portfolio_id: str = Depends(get_portfolio_id)):
+    apartment = await db.apartments.find_one({"portfolio_id": portfolio_id, "id": apartment_id})
     if not apartment:
         raise HTTPException(status_code=404, detail="Apartment not found")
     return Apartment(**apartment)
 
 @api_router.put("/apartments/{apartment_id}", response_model=Apartment)
-async def update_apartment(apartment_id: str, apartment_update: ApartmentCreate):
-    existing = await db.apartments.find_one({"id": apartment_id})
+async def update_apartment(apartment_id: str, apartment_update: ApartmentCreate, portfolio_id: str = Depends(get_portfolio_id)):
+    existing = await db.apartments.find_one({"portfolio_id": portfolio_id, "id": apartment_id})
     if not existing:
         raise HTTPException(status_code=404, detail="Apartment not found")
     
     update_dict = apartment_update.dict()
-    await db.apartments.update_one({"id": apartment_id}, {"$set": update_dict})
+    async def write(session):
+        await db.apartments.update_one({"portfolio_id": portfolio_id, "id": apartment_id}, {"$set": update_dict}, session=session)
+        await _append_event(session, portfolio_id, "apartment", apartment_id, "updated")
+    await _run_mutation(write)
     
-    updated_apartment = await db.apartments.find_one({"id": apartment_id})
+    updated_apartment = await db.apartments.find_one({"portfolio_id": portfolio_id, "id": apartment_id})
     return Apartment(**updated_apartment)
 
 @api_router.delete("/apartments/{apartment_id}")
-async def delete_apartment(apartment_id: str):
-    result = await db.apartments.delete_one({"id": apartment_id})
-    if result.deleted_count == 0:
-        raise HTTPException(status_code=404, detail="Apartment not found")
+async def delete_apartment(apartment_id: str, portfolio_id: str = Depends(get_portfolio_id)):
+    async def write(session):
+        result = await db.apartments.delete_one({"portfolio_id": portfolio_id, "id": apartment_id}, session=session)
+        if result.deleted_count == 0:
+            raise HTTPException(status_code=404, detail="Apartment not found")
+        await _append_event(session, portfolio_id, "apartment", apartment_id, "deleted")
+    await _run_mutation(write)
     return {"message": "Apartment deleted successfully"}
 
 # Tenant CRUD
 @api_router.post("/tenants", response_model=Tenant)
-async def create_tenant(tenant: TenantCreate):
+async def create_tenant(tenant: TenantCreate, portfolio_id: str = Depends(get_portfolio_id)):
     tenant_dict = tenant.dict()
-    tenant_obj = Tenant(**tenant_dict)
-    await db.tenants.insert_one(tenant_obj.dict())
+    tenant_obj = Tenant(**tenant_dict, portfolio_id=portfolio_id)
+    async def write(session):
+        await db.tenants.insert_one(tenant_obj.dict(), session=session)
+        await _append_event(session, portfolio_id, "tenant", tenant_obj.id, "created")
+    await _run_mutation(write)
     return tenant_obj
 
 @api_router.get("/tenants", response_model=List[Tenant])
-async def get_tenants():
-    tenants = await db.tenants.find().to_list(1000)
+async def get_tenants(portfolio_id: str = Depends(get_portfolio_id)):
+    tenants = await db.tenants.find({"portfolio_id": portfolio_id}).to_list(1000)
     return [Tenant(**tenant) for tenant in tenants]
 
+@api_router.get("/tenants/balances", response_model=List[TenantBalance])
+async def get_tenant_balances(min_owed: Optional[float] = None, max_owed: Optional[float] = None,
+                              descending: bool = True, skip: int = 0, limit: int = 100,
+                              portfolio_id: str = Depends(get_portfolio_id)):
+    query = {"portfolio_id": portfolio_id}
+    if min_owed is not None:
+        query.setdefault("balance", {})["$gte"] = min_owed
+    if max_owed is not None:
+        query.setdefault("balance", {})["$lte"] = max_owed
+    balances = await db.tenant_balances.find(query, {"_id": 0}).sort(
+        "balance", -1 if descending else 1
+    ).skip(max(skip, 0)).limit(min(max(limit, 1), 1000)).to_list(1000)
+    return [TenantBalance(**balance) for balance in balances]
+
 @api_router.get("/tenants/{tenant_id}", response_model=Tenant)
-async def get_tenant(tenant_id: str):
-    tenant = await db.tenants.find_one({"id": tenant_id})
+async def get_tenant(tenant_id: str, portfolio_id: str = Depends(get_portfolio_id)):
+    tenant = await db.tenants.find_one({"portfolio_id": portfolio_id, "id": tenant_id})
     if not tenant:
         raise HTTPException(status_code=404, detail="Tenant not found")
     return Tenant(**tenant)
 
 @api_router.put("/tenants/{tenant_id}", response_model=Tenant)
-async def update_tenant(tenant_id: str, tenant_update: TenantCreate):
-    existing = await db.tenants.find_one({"id": tenant_id})
+async def update_tenant(tenant_id: str, tenant_update: TenantCreate, portfolio_id: str = Depends(get_portfolio_id)):
+    existing = await db.tenants.find_one({"portfolio_id": portfolio_id, "id": tenant_id})
     if not existing:
         raise HTTPException(status_code=404, detail="Tenant not found")
     
     update_dict = tenant_update.dict()
-    await db.tenants.update_one({"id": tenant_id}, {"$set": update_dict})
+    async def write(session):
+        await db.tenants.update_one({"portfolio_id": portfolio_id, "id": tenant_id}, {"$set": update_dict}, session=session)
+        await _append_event(session, portfolio_id, "tenant", tenant_id, "updated")
+    await _run_mutation(write)
     
-    updated_tenant = await db.tenants.find_one({"id": tenant_id})
+    updated_tenant = await db.tenants.find_one({"portfolio_id": portfolio_id, "id": tenant_id})
     return Tenant(**updated_tenant)
 
 @api_router.delete("/tenants/{tenant_id}")
-async def delete_tenant(tenant_id: str):
-    result = await db.tenants.delete_one({"id": tenant_id})
-    if result.deleted_count == 0:
-        raise HTTPException(status_code=404, detail="Tenant not found")
+async def delete_tenant(tenant_id: str, portfolio_id: str = Depends(get_portfolio_id)):
+    async def write(session):
+        result = await db.tenants.delete_one({"portfolio_id": portfolio_id, "id": tenant_id}, session=session)
+        if result.deleted_count == 0:
+            raise HTTPException(status_code=404, detail="Tenant not found")
+        await db.ledger_entries.delete_many({"portfolio_id": portfolio_id, "tenant_id": tenant_id}, session=session)
+        await db.tenant_balances.delete_one({"portfolio_id": portfolio_id, "tenant_id": tenant_id}, session=session)
+        await _append_event(session, portfolio_id, "tenant", tenant_id, "deleted")
+    await _run_mutation(write)
     return {"message": "Tenant deleted successfully"}
 
+@api_router.get("/tenants/{tenant_id}/ledger", response_model=TenantLedger)
+async def get_tenant_ledger(tenant_id: str, skip: int = 0, limit: int = 50, portfolio_id: str = Depends(get_portfolio_id)):
+    balance = await db.tenant_balances.find_one({"portfolio_id": portfolio_id, "tenant_id": tenant_id}, {"_id": 0})
+    if not balance:
+        if not await db.tenants.find_one({"portfolio_id": portfolio_id, "id": tenant_id}, {"_id": 1}):
+            raise HTTPException(status_code=404, detail="Tenant not found")
+        balance = {"portfolio_id": portfolio_id, "tenant_id": tenant_id}
+    skip = max(skip, 0)
+    limit = min(max(limit, 1), 500)
+    entries = await db.ledger_entries.find({"portfolio_id": portfolio_id, "tenant_id": tenant_id}, {"_id": 0}).sort(
+        "sequence", -1
+    ).skip(skip).limit(limit).to_list(limit)
+    return TenantLedger(
+        balance=TenantBalance(**balance),
+        entries=[LedgerEntry(**entry) for entry in entries],
+        skip=skip,
+        limit=limit
+    )
+
+@api_router.post("/tenants/{tenant_id}/ledger/rebuild", response_model=TenantBalance)
+async def rebuild_tenant_ledger(tenant_id: str, portfolio_id: str = Depends(get_portfolio_id)):
+    """Regenerate a tenant's ledger from their rent payments (backfill for payments recorded before the ledger)"""
+    if not await db.tenants.find_one({"portfolio_id": portfolio_id, "id": tenant_id}, {"_id": 1}):
+        raise HTTPException(status_code=404, detail="Tenant not found")
+    if not _supports_transactions:
+        raise HTTPException(
+            status_code=409, detail="Ledger rebuild needs a replica set; pause writes and run backfill_ledger.py instead"
+        )
+    return await rebuild_ledger(portfolio_id, tenant_id)
+
 # Rent Payment CRUD
+SETTLEMENT_FIELDS = ("status", "amount_paid", "paid_date", "payment_method", "notes")
+
+async def _check_tenant(portfolio_id: str, tenant_id: str):
+    if not await db.tenants.find_one({"portfolio_id": portfolio_id, "id": tenant_id}, {"_id": 1}):
+        raise HTTPException(status_code=400, detail="Tenant not found in this portfolio")
+
+def _is_settlement(current: dict, update_dict: dict) -> bool:
+    """True when an update only records payment against the charge, leaving what was billed and when unchanged"""
+    return all(update_dict[field] == current.get(field) for field in update_dict if field not in SETTLEMENT_FIELDS)
+
 @api_router.post("/rent-payments", response_model=RentPayment)
-async def create_rent_payment(payment: RentPaymentCreate):
+async def create_rent_payment(payment: RentPaymentCreate, portfolio_id: str = Depends(get_portfolio_id)):
     payment_dict = payment.dict()
-    payment_obj = RentPayment(**payment_dict)
-    await db.rent_payments.insert_one(payment_obj.dict())
+    payment_dict["amount_paid"] = _resolve_amount_paid(payment)
+    _check_open_years(portfolio_id, payment_dict)
+    await _check_tenant(portfolio_id, payment.tenant_id)
+    payment_obj = RentPayment(**payment_dict, portfolio_id=portfolio_id)
+    async def write(session):
+        await db.rent_payments.insert_one(payment_obj.dict(), session=session)
+        await _post_payment_to_ledger(payment_obj.dict(), session=session)
+        await _append_event(session, portfolio_id, "rent_payment", payment_obj.id, "created", payment_dict)
+    await _run_mutation(write)
     return payment_obj
 
 @api_router.get("/rent-payments", response_model=List[RentPayment])
-async def get_rent_payments():
-    payments = await db.rent_payments.find().to_list(1000)
+async def get_rent_payments(portfolio_id: str = Depends(get_portfolio_id)):
+    payments = await db.rent_payments.find({"portfolio_id": portfolio_id}).to_list(1000)
     return [RentPayment(**payment) for payment in payments]
 
 @api_router.put("/rent-payments/{payment_id}", response_model=RentPayment)
-async def update_rent_payment(payment_id: str, payment_update: RentPaymentCreate):
-    existing = await db.rent_payments.find_one({"id": payment_id})
-    if not existing:
-        raise HTTPException(status_code=404, detail="Payment not found")
-    
+async def update_rent_payment(payment_id: str, payment_update: RentPaymentCreate, portfolio_id: str = Depends(get_portfolio_id)):
     update_dict = payment_update.dict()
-    await db.rent_payments.update_one({"id": payment_id}, {"$set": update_dict})
-    
-    updated_payment = await db.rent_payments.find_one({"id": payment_id})
+    update_dict["amount_paid"] = _resolve_amount_paid(payment_update)
+    current = await db.rent_payments.find_one({"portfolio_id": portfolio_id, "id": payment_id})
+    if not current:
+        raise HTTPException(status_code=404, detail="Payment not found")
+    if _is_settlement(current, update_dict):
+        # Open balances outlive a closed year; they can still be settled with a payment dated in an open year
+        _check_open_years(portfolio_id, {"paid_date": current.get("paid_date")}, {"paid_date": update_dict["paid_date"]})
+    else:
+        _check_open_years(portfolio_id, current, update_dict)
+    await _check_tenant(portfolio_id, payment_update.tenant_id)
+    async def write(session):
+        # The pre-image comes from the write itself, so concurrent edits each post the delta from their own version
+        existing = await db.rent_payments.find_one_and_update(
+            {"portfolio_id": portfolio_id, "id": payment_id},
+            {"$set": update_dict},
+            return_document=ReturnDocument.BEFORE,
+            session=session,
+        )
+        if not existing:
+            raise HTTPException(status_code=404, detail="Payment not found")
+        updated_payment = {**existing, **update_dict}
+        await _update_payment_in_ledger(existing, updated_payment, session=session)
+        await _append_event(session, portfolio_id, "rent_payment", payment_id, "updated", existing, updated_payment)
+        return updated_payment
+    updated_payment = await _run_mutation(write)
     return RentPayment(**updated_payment)
 
 # Expense CRUD
 @api_router.post("/expenses", response_model=Expense)
-async def create_expense(expense: ExpenseCreate):
+async def create_expense(expense: ExpenseCreate, portfolio_id: str = Depends(get_portfolio_id)):
     expense_dict = expense.dict()
-    expense_obj = Expense(**expense_dict)
-    await db.expenses.insert_one(expense_obj.dict())
+    _check_open_years(portfolio_id, expense_dict)
+    expense_obj = Expense(**expense_dict, portfolio_id=portfolio_id)
+    async def write(session):
+        await db.expenses.insert_one(expense_obj.dict(), session=session)
+        await _append_event(session, portfolio_id, "expense", expense_obj.id, "created", expense_dict)
+    await _run_mutation(write)
     return expense_obj
 
 @api_router.get("/expenses", response_model=List[Expense])
-async def get_expenses():
-    expenses = await db.expenses.find().to_list(1000)
+async def get_expenses(portfolio_id: str = Depends(get_portfolio_id)):
+    expenses = await db.expenses.find({"portfolio_id": portfolio_id}).to_list(1000)
     return [Expense(**expense) for expense in expenses]
 
 @api_router.put("/expenses/{expense_id}", response_model=Expense)
-async def update_expense(expense_id: str, expense_update: ExpenseCreate):
-    existing = await db.expenses.find_one({"id": expense_id})
-    if not existing:
+async def update_expense(expense_id: str, expense_update: ExpenseCreate, portfolio_id: str = Depends(get_portfolio_id)):
+    current = await db.expenses.find_one({"portfolio_id": portfolio_id, "id": expense_id}, {"date": 1})
+    if not current:
         raise HTTPException(status_code=404, detail="Expense not found")
     
     update_dict = expense_update.dict()
-    await db.expenses.update_one({"id": expense_id}, {"$set": update_dict})
-    
-    updated_expense = await db.expenses.find_one({"id": expense_id})
+    _check_open_years(portfolio_id, current, update_dict)
+    async def write(session):
+        # The pre-image comes from the write itself, so the event names the months this edit actually left
+        existing = await db.expenses.find_one_and_update(
+            {"portfolio_id": portfolio_id, "id": expense_id},
+            {"$set": update_dict},
+            return_document=ReturnDocument.BEFORE,
+            session=session,
+        )
+        if not existing:
+            raise HTTPException(status_code=404, detail="Expense not found")
+        updated_expense = {**existing, **update_dict}
+        await _append_event(session, portfolio_id, "expense", expense_id, "updated", existing, updated_expense)
+        return updated_expense
+    updated_expense = await _run_mutation(write)
     return Expense(**updated_expense)
 
 @api_router.delete("/expenses/{expense_id}")
-async def delete_expense(expense_id: str):
-    result = await db.expenses.delete_one({"id": expense_id})
-    if result.deleted_count == 0:
+async def delete_expense(expense_id: str, portfolio_id: str = Depends(get_portfolio_id)):
+    current = await db.expenses.find_one({"portfolio_id": portfolio_id, "id": expense_id}, {"date": 1})
+    if not current:
         raise HTTPException(status_code=404, detail="Expense not found")
+    _check_open_years(portfolio_id, current)
+    async def write(session):
+        existing = await db.expenses.find_one_and_delete({"portfolio_id": portfolio_id, "id": expense_id}, session=session)
+        if not existing:
+            raise HTTPException(status_code=404, detail="Expense not found")
+        await _append_event(session, portfolio_id, "expense", expense_id, "deleted", existing)
+    await _run_mutation(write)
     return {"message": "Expense deleted successfully"}
 
 # Financial Reports
 @api_router.get("/reports/monthly/{year}/{month}", response_model=FinancialSummary)
-async def get_monthly_report(year: int, month: int):
+async def get_monthly_report(year: int, month: int, portfolio_id: str = Depends(get_portfolio_id)):
+    snapshot = _load_snapshot(portfolio_id, year)
+    if snapshot and 1 <= month <= 12:
+        return FinancialSummary(**snapshot.aggregates["monthly_reports"][month - 1])
+
     # Calculate date range as strings
     if month < 10:
         start_date_str = f"{year}-0{month}-01"
@@ -298,17 +659,18 @@ async def get_monthly_report(year: int, month: int):
     else:
         end_date_str = f"{next_year}-{next_month}-01"
     
-    # Get rent payments for the month
+    # Get rent payments received in the month, including partial payments
     rent_payments = await db.rent_payments.find({
+        "portfolio_id": portfolio_id,
         "paid_date": {
             "$gte": start_date_str,
             "$lt": end_date_str
-        },
-        "status": "paid"
+        }
     }).to_list(1000)
     
     # Get expenses for the month
     expenses = await db.expenses.find({
+        "portfolio_id": portfolio_id,
         "date": {
             "$gte": start_date_str,
             "$lt": end_date_str
@@ -316,15 +678,16 @@ async def get_monthly_report(year: int, month: int):
     }).to_list(1000)
     
     # Calculate totals
-    total_rental_income = sum(payment["amount"] for payment in rent_payments)
+    total_rental_income = sum(_stored_amount_paid(payment) for payment in rent_payments)
     total_expenses = sum(expense["amount"] for expense in expenses)
     net_profit = total_rental_income - total_expenses
     
     # Calculate occupancy rate (simplified)
-    total_apartments = await db.apartments.count_documents({})
+    total_apartments = await db.apartments.count_documents({"portfolio_id": portfolio_id})
     
     # For occupied apartments, check if lease dates overlap with the month
     occupied_apartments = await db.tenants.find({
+        "portfolio_id": portfolio_id,
         "lease_start": {"$lte": end_date_str},
         "lease_end": {"$gte": start_date_str}
     }).to_list(1000)
@@ -345,10 +708,10 @@ async def get_monthly_report(year: int, month: int):
     )
 
 @api_router.get("/reports/yearly/{year}")
-async def get_yearly_report(year: int):
+async def get_yearly_report(year: int, portfolio_id: str = Depends(get_portfolio_id)):
     yearly_data = []
     for month in range(1, 13):
-        monthly_report = await get_monthly_report(year, month)
+        monthly_report = await get_monthly_report(year, month, portfolio_id)
         yearly_data.append(monthly_report)
     
     # Calculate yearly totals
@@ -367,28 +730,29 @@ async def get_yearly_report(year: int):
     }
 
 @api_router.get("/dashboard")
-async def get_dashboard():
+async def get_dashboard(portfolio_id: str = Depends(get_portfolio_id)):
     # Get current month/year
     now = datetime.now()
     current_year = now.year
     current_month = now.month
     
     # Get current month report
-    current_report = await get_monthly_report(current_year, current_month)
+    current_report = await get_monthly_report(current_year, current_month, portfolio_id)
     
     # Get total counts
-    total_apartments = await db.apartments.count_documents({})
-    total_tenants = await db.tenants.count_documents({})
+    total_apartments = await db.apartments.count_documents({"portfolio_id": portfolio_id})
+    total_tenants = await db.tenants.count_documents({"portfolio_id": portfolio_id})
     
     # Get overdue payments (comparing string dates)
     today_str = now.strftime("%Y-%m-%d")
     overdue_payments = await db.rent_payments.find({
+        "portfolio_id": portfolio_id,
         "due_date": {"$lt": today_str},
         "status": {"$in": ["unpaid", "partial"]}
     }).to_list(100)
     
     # Get recent expenses
-    recent_expenses = await db.expenses.find().sort("date", -1).limit(5).to_list(5)
+    recent_expenses = await db.expenses.find({"portfolio_id": portfolio_id}).sort("date", -1).limit(5).to_list(5)
     
     return {
         "current_month_report": current_report,
@@ -399,6 +763,663 @@ async def get_dashboard():
         "recent_expenses": [Expense(**expense) for expense in recent_expenses]
     }
 
+# Analytics
+ANALYTICS_CHUNK_SIZE = 50000
+EXPENSE_TYPES = [expense_type.value for expense_type in ExpenseType]
+PAYMENT_SNAPSHOT_FIELDS = ["amount", "amount_paid", "status", "due_date", "paid_date"]
+EXPENSE_SNAPSHOT_FIELDS = ["amount", "expense_type", "date"]
+GROUPED_PAYMENT_FIELDS = ["amount", "amount_paid", "due_date", "paid_date"]
+# Payments recorded before amount_paid existed count in full only when paid
+PAYMENT_AMOUNT_PAID_EXPR = {"$ifNull": [
+    "$amount_paid", {"$cond": [{"$eq": ["$status", RentStatus.PAID.value]}, "$amount", 0]}
+]}
+
+def _month_index(dates, start_year: int):
+    """Vectorized "YYYY-MM..." -> months since January of start_year, plus a validity mask"""
+    chars = np.asarray(dates, dtype="U7").view(np.uint32).reshape(-1, 7).astype(np.int64) - ord("0")
+    digits = chars[:, [0, 1, 2, 3, 5, 6]]
+    years = digits[:, 0] * 1000 + digits[:, 1] * 100 + digits[:, 2] * 10 + digits[:, 3]
+    months = digits[:, 4] * 10 + digits[:, 5]
+    valid = (
+        ((digits >= 0) & (digits <= 9)).all(axis=1)
+        & (chars[:, 4] == ord("-") - ord("0"))
+        & (months >= 1) & (months <= 12)
+    )
+    return (years - start_year) * 12 + months - 1, valid
+
+def _month_key_expr(field: str) -> dict:
+    return {"$substrCP": [{"$ifNull": [f"${field}", ""]}, 0, 7]}
+
+async def _grouped_payment_columns(portfolio_id: str, date_range: dict) -> dict:
+    """Payments bucketed in Mongo, returned as columns of a few hundred rows.
+
+    Billed and collected are bucketed by due month and income by paid month, as two aggregations that
+    each walk a single date index, rather than one $or over both indexes that has to dedupe every row.
+    Each row leaves the other date empty, so it only lands in its own buckets.
+    """
+    by_due, by_paid = await asyncio.gather(
+        db.rent_payments.aggregate([
+            {"$match": {"portfolio_id": portfolio_id, "due_date": date_range}},
+            {"$group": {
+                "_id": _month_key_expr("due_date"),
+                "amount": {"$sum": "$amount"},
+                "amount_paid": {"$sum": PAYMENT_AMOUNT_PAID_EXPR},
+            }},
+        ], hint="portfolio_id_1_due_date_1").to_list(None),
+        db.rent_payments.aggregate([
+            {"$match": {"portfolio_id": portfolio_id, "paid_date": date_range}},
+            {"$group": {"_id": _month_key_expr("paid_date"), "amount_paid": {"$sum": PAYMENT_AMOUNT_PAID_EXPR}}},
+        ], hint="portfolio_id_1_paid_date_1").to_list(None),
+    )
+    return {
+        "due_date": [row["_id"] for row in by_due] + [""] * len(by_paid),
+        "paid_date": [""] * len(by_due) + [row["_id"] for row in by_paid],
+        "amount": [row["amount"] for row in by_due] + [0.0] * len(by_paid),
+        "amount_paid": [row["amount_paid"] for row in by_due + by_paid],
+    }
+
+async def _grouped_expense_columns(query: dict) -> dict:
+    """Expenses bucketed by (month, expense type) in Mongo"""
+    rows = await db.expenses.aggregate([
+        {"$match": query},
+        {"$group": {
+            "_id": {"date": _month_key_expr("date"), "expense_type": "$expense_type"},
+            "amount": {"$sum": "$amount"},
+        }},
+    ]).to_list(None)
+    return {
+        "date": [row["_id"]["date"] for row in rows],
+        "expense_type": [row["_id"]["expense_type"] for row in rows],
+        "amount": [row["amount"] for row in rows],
+    }
+
+async def _iter_column_chunks(collection, query: dict, fields: List[str], chunk_size: int = ANALYTICS_CHUNK_SIZE):
+    """Single projected cursor pass, yielding {field: list} column chunks of bounded size"""
+    projection = {"_id": 0, **{field: 1 for field in fields}}
+    cursor = collection.find(query, projection, batch_size=chunk_size)
+    while True:
+        docs = await cursor.to_list(chunk_size)
+        if not docs:
+            break
+        yield {field: [doc.get(field) for doc in docs] for field in fields}
+
+class CashFlowAccumulator:
+    """Fixed-size monthly buckets, so memory does not grow with the number of rows"""
+
+    def __init__(self, start_year: int, end_year: int):
+        self.start_year = start_year
+        self.n_months = (end_year - start_year + 1) * 12
+        self.income = np.zeros(self.n_months)
+        self.billed = np.zeros(self.n_months)
+        self.collected = np.zeros(self.n_months)
+        self.expenses = np.zeros(self.n_months)
+        self.expenses_by_type = np.zeros((self.n_months, len(EXPENSE_TYPES)))
+
+    def _bucket(self, index, valid, weights, minlength: int):
+        mask = valid & (index >= 0) & (index < minlength)
+        return np.bincount(index[mask], weights=weights[mask], minlength=minlength)
+
+    def _restrict(self, index, valid, months):
+        """Keep only rows falling in the selected months, so each month is counted from one source"""
+        if months is None:
+            return valid
+        inside = (index >= 0) & (index < self.n_months)
+        return valid & inside & months[np.where(inside, index, 0)]
+
+    def year_months(self, years) -> np.ndarray:
+        years = np.asarray(list(years), dtype=np.int64)
+        return np.isin(np.arange(self.n_months) // 12 + self.start_year, years)
+
+    def add_payments(self, columns: dict, months: Optional[np.ndarray] = None):
+        """Accepts raw payment rows or pre-grouped rows, whose amount_paid is already resolved"""
+        amount = np.asarray(columns["amount"], dtype=float)
+        status = columns.get("status")
+        is_paid = np.asarray(status, dtype=object) == RentStatus.PAID.value if status is not None else False
+        # Payments recorded before amount_paid existed count in full only when paid
+        amount_paid = np.asarray(columns["amount_paid"], dtype=float)
+        amount_paid = np.where(np.isnan(amount_paid), np.where(is_paid, amount, 0.0), amount_paid)
+        due_index, due_valid = _month_index(columns["due_date"], self.start_year)
+        paid_index, paid_valid = _month_index(columns["paid_date"], self.start_year)
+        due_valid = self._restrict(due_index, due_valid, months)
+        paid_valid = self._restrict(paid_index, paid_valid, months)
+
+        self.income += self._bucket(paid_index, paid_valid, amount_paid, self.n_months)
+        self.billed += self._bucket(due_index, due_valid, amount, self.n_months)
+        self.collected += self._bucket(due_index, due_valid, amount_paid, self.n_months)
+
+    def add_expenses(self, columns: dict, months: Optional[np.ndarray] = None):
+        amount = np.asarray(columns["amount"], dtype=float)
+        month_index, valid = _month_index(columns["date"], self.start_year)
+        valid = self._restrict(month_index, valid, months)
+        type_codes = pd.Categorical(columns["expense_type"], categories=EXPENSE_TYPES).codes.astype(np.int64)
+        type_codes[type_codes < 0] = EXPENSE_TYPES.index(ExpenseType.OTHER.value)
+
+        self.expenses += self._bucket(month_index, valid, amount, self.n_months)
+        flat_index = np.where(valid, month_index * len(EXPENSE_TYPES) + type_codes, -1)
+        by_type = self._bucket(flat_index, valid, amount, self.n_months * len(EXPENSE_TYPES))
+        self.expenses_by_type += by_type.reshape(self.n_months, len(EXPENSE_TYPES))
+
+    def to_frame(self, rolling_window: int) -> pd.DataFrame:
+        frame = pd.DataFrame(
+            {
+                "rental_income": self.income,
+                "expenses": self.expenses,
+                "billed": self.billed,
+                "collected": self.collected,
+            },
+            index=pd.period_range(f"{self.start_year}-01", periods=self.n_months, freq="M"),
+        )
+        frame["net_cash_flow"] = frame["rental_income"] - frame["expenses"]
+        frame["cumulative_net_cash_flow"] = frame["net_cash_flow"].cumsum()
+        rolling = frame[["rental_income", "expenses", "net_cash_flow"]].rolling(rolling_window, min_periods=1).mean()
+        frame = frame.join(rolling.add_prefix("rolling_"))
+        frame["collection_rate"] = np.divide(
+            frame["collected"] * 100, frame["billed"],
+            out=np.zeros(self.n_months), where=frame["billed"].to_numpy() > 0
+        )
+        return frame
+
+def _project_lease_rent(columns: dict, months_ahead: int, now: datetime):
+    """Forward rent roll from lease windows via a difference array over the projection horizon"""
+    rent = np.asarray(columns["monthly_rent"], dtype=float)
+    start_index, start_valid = _month_index(columns["lease_start"], now.year)
+    end_index, end_valid = _month_index(columns["lease_end"], now.year)
+    offset = now.month - 1
+    start = np.clip(start_index - offset, 0, months_ahead)
+    stop = np.clip(end_index - offset + 1, 0, months_ahead)
+    mask = start_valid & end_valid & (start < stop)
+
+    rent_diff = np.zeros(months_ahead + 1)
+    lease_diff = np.zeros(months_ahead + 1, dtype=np.int64)
+    np.add.at(rent_diff, start[mask], rent[mask])
+    np.add.at(rent_diff, stop[mask], -rent[mask])
+    np.add.at(lease_diff, start[mask], 1)
+    np.add.at(lease_diff, stop[mask], -1)
+    return np.cumsum(rent_diff)[:months_ahead], np.cumsum(lease_diff)[:months_ahead]
+
+@api_router.get("/analytics")
+async def get_analytics(
+    start_year: Optional[int] = None,
+    end_year: Optional[int] = None,
+    rolling_window: int = 3,
+    forecast_months: int = 12,
+    portfolio_id: str = Depends(get_portfolio_id),
+):
+    now = datetime.now()
+    end_year = end_year or now.year
+    start_year = start_year or end_year - 9
+    if start_year > end_year or end_year - start_year >= 50:
+        raise HTTPException(status_code=400, detail="Invalid year range")
+    if rolling_window < 1 or not 0 <= forecast_months <= 120:
+        raise HTTPException(status_code=400, detail="Invalid rolling window or forecast horizon")
+
+    accumulator = CashFlowAccumulator(start_year, end_year)
+    closed_years = [year for year in range(start_year, end_year + 1) if _load_snapshot(portfolio_id, year)]
+    for year in closed_years:
+        snapshot = _load_snapshot(portfolio_id, year)
+        year_months = accumulator.year_months([year])
+        if snapshot.has_table("payments_monthly"):
+            accumulator.add_payments(snapshot.columns("payments_monthly", GROUPED_PAYMENT_FIELDS), year_months)
+            accumulator.add_expenses(snapshot.columns("expenses_monthly", EXPENSE_SNAPSHOT_FIELDS), year_months)
+        else:
+            accumulator.add_payments(snapshot.columns("payments", PAYMENT_SNAPSHOT_FIELDS), year_months)
+            accumulator.add_expenses(snapshot.columns("expenses", EXPENSE_SNAPSHOT_FIELDS), year_months)
+
+    # Live collections only for the open years, split into contiguous ranges around closed ones
+    open_months = ~accumulator.year_months(closed_years)
+    open_years = [year for year in range(start_year, end_year + 1) if year not in closed_years]
+    open_ranges = []
+    for year in open_years:
+        if open_ranges and open_ranges[-1][1] == year - 1:
+            open_ranges[-1][1] = year
+        else:
+            open_ranges.append([year, year])
+    for range_start, range_end in open_ranges:
+        date_range = {"$gte": f"{range_start}-01-01", "$lt": f"{range_end + 1}-01-01"}
+        accumulator.add_payments(await _grouped_payment_columns(portfolio_id, date_range), open_months)
+        accumulator.add_expenses(await _grouped_expense_columns(
+            {"portfolio_id": portfolio_id, "date": date_range}
+        ), open_months)
+
+    projected_rent = np.zeros(forecast_months)
+    active_leases = np.zeros(forecast_months, dtype=np.int64)
+    async for columns in _iter_column_chunks(
+        db.tenants,
+        {"portfolio_id": portfolio_id, "lease_end": {"$gte": now.strftime("%Y-%m-01")}},
+        ["monthly_rent", "lease_start", "lease_end"],
+    ):
+        chunk_rent, chunk_leases = _project_lease_rent(columns, forecast_months, now)
+        projected_rent += chunk_rent
+        active_leases += chunk_leases
+
+    frame = accumulator.to_frame(rolling_window)
+    breakdown = pd.DataFrame(accumulator.expenses_by_type, index=frame.index, columns=EXPENSE_TYPES)
+    monthly_cash_flow = frame.round(2).reset_index(names="month")
+    monthly_cash_flow["month"] = monthly_cash_flow["month"].astype(str)
+    monthly_cash_flow["expense_breakdown"] = breakdown.round(2).to_dict("records")
+
+    total_billed = float(accumulator.billed.sum())
+    total_collected = float(accumulator.collected.sum())
+    total_income = float(accumulator.income.sum())
+    total_expenses = float(accumulator.expenses.sum())
+    forecast_index = pd.period_range(f"{now.year}-{now.month:02d}", periods=forecast_months, freq="M")
+
+    return {
+        "start_year": start_year,
+        "end_year": end_year,
+        "rolling_window": rolling_window,
+        "total_rental_income": total_income,
+        "total_expenses": total_expenses,
+        "net_cash_flow": total_income - total_expenses,
+        "collection_rate": round(total_collected / total_billed * 100, 2) if total_billed > 0 else 0,
+        "expense_breakdown": dict(zip(EXPENSE_TYPES, accumulator.expenses_by_type.sum(axis=0).round(2).tolist())),
+        "monthly_cash_flow": monthly_cash_flow.to_dict("records"),
+        "rent_projection": [
+            {"month": str(month), "projected_rent": round(float(rent), 2), "active_leases": int(leases)}
+            for month, rent, leases in zip(forecast_index, projected_rent, active_leases)
+        ],
+    }
+
+# Year-end archive
+SNAPSHOT_SCHEMAS = {
+    "payments": pa.schema([
+        ("id", pa.string()), ("tenant_id", pa.string()), ("apartment_id", pa.string()),
+        ("amount", pa.float64()), ("amount_paid", pa.float64()), ("status", pa.string()),
+        ("due_date", pa.string()), ("paid_date", pa.string()),
+    ]),
+    "expenses": pa.schema([
+        ("id", pa.string()), ("apartment_id", pa.string()), ("expense_type", pa.string()),
+        ("amount", pa.float64()), ("date", pa.string()), ("vendor", pa.string()),
+    ]),
+    "payments_monthly": pa.schema([
+        ("due_date", pa.string()), ("paid_date", pa.string()),
+        ("amount", pa.float64()), ("amount_paid", pa.float64()),
+    ]),
+    "expenses_monthly": pa.schema([
+        ("date", pa.string()), ("expense_type", pa.string()), ("amount", pa.float64()),
+    ]),
+}
+# Bounded LRU of loaded snapshots, keyed by (portfolio_id, year)
+_snapshot_cache = OrderedDict()
+
+class YearSnapshot:
+    """A closed year: Arrow IPC tables memory-mapped from disk plus precomputed aggregates"""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.mtime_ns = (path / "aggregates.json").stat().st_mtime_ns
+        self.aggregates = json.loads((path / "aggregates.json").read_text())
+        self._tables = {}
+
+    def table(self, name: str) -> pa.Table:
+        if name not in self._tables:
+            source = pa.memory_map(str(self.path / f"{name}.arrow"), "r")
+            self._tables[name] = pa.ipc.open_file(source).read_all()
+        return self._tables[name]
+
+    def has_table(self, name: str) -> bool:
+        return (self.path / f"{name}.arrow").exists()
+
+    def columns(self, name: str, fields: List[str]) -> dict:
+        table = self.table(name)
+        return {field: table.column(field).to_numpy() for field in fields}
+
+def _load_snapshot(portfolio_id: str, year: int) -> Optional[YearSnapshot]:
+    key = (portfolio_id, year)
+    path = ARCHIVE_DIR / portfolio_id / str(year)
+    # aggregates.json is written last, so its presence marks a complete snapshot. Checked on every
+    # call and misses are not cached, so a year closed (or re-closed) by another process is seen.
+    try:
+        mtime_ns = (path / "aggregates.json").stat().st_mtime_ns
+    except FileNotFoundError:
+        _snapshot_cache.pop(key, None)
+        return None
+    snapshot = _snapshot_cache.get(key)
+    if snapshot is None or snapshot.mtime_ns != mtime_ns:
+        snapshot = _snapshot_cache[key] = YearSnapshot(path)
+    _snapshot_cache.move_to_end(key)
+    while len(_snapshot_cache) > SNAPSHOT_CACHE_SIZE:
+        _snapshot_cache.popitem(last=False)
+    return snapshot
+
+async def _export_snapshot_table(collection, query: dict, path: Path, schema: pa.Schema) -> int:
+    """Stream a query into an Arrow IPC file; conversion and disk writes run off the event loop"""
+    rows = 0
+    with pa.OSFile(str(path), "wb") as sink, pa.ipc.new_file(sink, schema) as writer:
+        async for columns in _iter_column_chunks(collection, query, schema.names):
+            await asyncio.to_thread(lambda: writer.write_batch(pa.RecordBatch.from_pydict(columns, schema=schema)))
+            rows += len(columns[schema.names[0]])
+    return rows
+
+def _write_snapshot_table(path: Path, columns: dict, schema: pa.Schema):
+    with pa.OSFile(str(path), "wb") as sink, pa.ipc.new_file(sink, schema) as writer:
+        writer.write_table(pa.Table.from_pydict(columns, schema=schema))
+
+def _publish_snapshot(staging: Path, target: Path, aggregates: dict):
+    # aggregates.json goes last, so its presence marks a complete snapshot
+    (staging / "aggregates.json").write_text(json.dumps(aggregates))
+    shutil.rmtree(target, ignore_errors=True)
+    staging.rename(target)
+
+@api_router.get("/archive")
+async def get_archive(portfolio_id: str = Depends(get_portfolio_id)):
+    years = sorted(
+        int(path.name) for path in (ARCHIVE_DIR / portfolio_id).glob("[0-9]*")
+        if _load_snapshot(portfolio_id, int(path.name))
+    )
+    return [{"year": year, **_load_snapshot(portfolio_id, year).aggregates["row_counts"]} for year in years]
+
+@api_router.post("/archive/{year}/close")
+async def close_year(year: int, prune: bool = False, portfolio_id: str = Depends(get_portfolio_id)):
+    if year >= datetime.now().year:
+        raise HTTPException(status_code=400, detail="Only past years can be closed")
+    if _load_snapshot(portfolio_id, year):
+        raise HTTPException(status_code=409, detail="Year already closed")
+
+    start_date_str = f"{year}-01-01"
+    end_date_str = f"{year + 1}-01-01"
+    date_range = {"$gte": start_date_str, "$lt": end_date_str}
+    queries = {
+        "payments": (db.rent_payments, {
+            "portfolio_id": portfolio_id,
+            "$or": [{"due_date": date_range}, {"paid_date": date_range}]
+        }),
+        "expenses": (db.expenses, {"portfolio_id": portfolio_id, "date": date_range}),
+    }
+
+    # Build in a staging directory and rename, so readers never see a partial snapshot. Creating the
+    # directory claims the close: a concurrent close of the same year finds it and backs off.
+    portfolio_dir = ARCHIVE_DIR / portfolio_id
+    staging = portfolio_dir / f".{year}.tmp"
+    try:
+        await asyncio.to_thread(staging.mkdir, parents=True)
+    except FileExistsError:
+        raise HTTPException(status_code=409, detail="Year is already being closed")
+    try:
+        row_counts = {}
+        for name, (collection, query) in queries.items():
+            row_counts[name] = await _export_snapshot_table(
+                collection, query, staging / f"{name}.arrow", SNAPSHOT_SCHEMAS[name]
+            )
+        # Month-bucketed copies let analytics read a closed year without touching the row-level tables
+        for name, grouped_columns in (
+            ("payments_monthly", await _grouped_payment_columns(portfolio_id, date_range)),
+            ("expenses_monthly", await _grouped_expense_columns(queries["expenses"][1])),
+        ):
+            await asyncio.to_thread(_write_snapshot_table, staging / f"{name}.arrow", grouped_columns, SNAPSHOT_SCHEMAS[name])
+        monthly_reports = [(await get_monthly_report(year, month, portfolio_id)).dict() for month in range(1, 13)]
+        aggregates = {
+            "year": year,
+            "closed_at": datetime.utcnow().isoformat(),
+            "row_counts": row_counts,
+            "monthly_reports": monthly_reports,
+        }
+        await asyncio.to_thread(_publish_snapshot, staging, portfolio_dir / str(year), aggregates)
+    except BaseException:
+        await asyncio.to_thread(shutil.rmtree, staging, ignore_errors=True)
+        raise
+    _snapshot_cache.pop((portfolio_id, year), None)
+
+    pruned = {"payments": 0, "expenses": 0}
+    if prune:
+        # Only settled payments entirely inside the year; open balances stay live
+        payments = await db.rent_payments.delete_many({
+            "portfolio_id": portfolio_id,
+            "due_date": date_range,
+            "paid_date": date_range,
+            "status": RentStatus.PAID.value
+        })
+        expenses = await db.expenses.delete_many({"portfolio_id": portfolio_id, "date": date_range})
+        pruned = {"payments": payments.deleted_count, "expenses": expenses.deleted_count}
+
+    return {"year": year, "row_counts": row_counts, "pruned": pruned}
+
+# Outbox consumers
+OUTBOX_CONSUMERS = {}
+_outbox_tasks = []
+
+def outbox_consumer(name: str):
+    """Register an idempotent batch handler; events are delivered at least once"""
+    def register(handler):
+        OUTBOX_CONSUMERS[name] = handler
+        return handler
+    return register
+
+@outbox_consumer("monthly_rollups")
+async def refresh_monthly_rollups(events: List[dict]):
+    """Recompute income/expense totals for every (portfolio, month) touched by the batch"""
+    touched = {
+        (event["portfolio_id"], month) for event in events
+        if event["entity"] in ("rent_payment", "expense")
+        for month in event["months"] if MONTH_PATTERN.match(month)
+    }
+    for portfolio_id, month in touched:
+        year, month_number = int(month[:4]), int(month[5:7])
+        snapshot = _load_snapshot(portfolio_id, year)
+        if snapshot:
+            # Closed (possibly pruned) years: the live collections no longer hold every row
+            report = snapshot.aggregates["monthly_reports"][month_number - 1]
+            total_income, total_expenses = report["total_rental_income"], report["total_expenses"]
+        else:
+            date_range = {"$gte": f"{month}-01", "$lt": f"{year + month_number // 12}-{month_number % 12 + 1:02d}-01"}
+            income = await db.rent_payments.aggregate([
+                {"$match": {"portfolio_id": portfolio_id, "paid_date": date_range}},
+                {"$group": {"_id": None, "total": {"$sum": PAYMENT_AMOUNT_PAID_EXPR}}},
+            ]).to_list(1)
+            expenses = await db.expenses.aggregate([
+                {"$match": {"portfolio_id": portfolio_id, "date": date_range}},
+                {"$group": {"_id": None, "total": {"$sum": "$amount"}}},
+            ]).to_list(1)
+            total_income = income[0]["total"] if income else 0.0
+            total_expenses = expenses[0]["total"] if expenses else 0.0
+        await db.monthly_rollups.update_one(
+            {"portfolio_id": portfolio_id, "month": month},
+            {"$set": {
+                "rental_income": total_income,
+                "expenses": total_expenses,
+                "net_profit": total_income - total_expenses,
+                "updated_at": datetime.utcnow(),
+            }},
+            upsert=True,
+        )
+
+async def _dead_letter_failures(consumer: str, handler, batch: List[dict]) -> int:
+    """Retry a repeatedly failing batch one event at a time, parking the events that still fail (see redrive_outbox.py)"""
+    dead_lettered = 0
+    for event in batch:
+        try:
+            await handler([event])
+        except Exception as error:
+            logger.exception("Outbox consumer %s dead-lettered event %s", consumer, event["_id"])
+            await db.events_dead_letter.update_one(
+                {"_id": {"consumer": consumer, "event_id": event["_id"]}},
+                {"$set": {"event": event, "error": repr(error), "failed_at": datetime.utcnow()}},
+                upsert=True,
+            )
+            dead_lettered += 1
+    return dead_lettered
+
+async def _renew_outbox_lease(checkpoint_id: str, consumer: str, partition: int, owner: str) -> Optional[dict]:
+    """Take or extend the lease on a checkpoint; returns the checkpoint, or None while another process holds it"""
+    now = datetime.utcnow()
+    try:
+        return await db.outbox_checkpoints.find_one_and_update(
+            {
+                "_id": checkpoint_id,
+                "$or": [{"owner": owner}, {"owner": None}, {"lease_expires_at": {"$lt": now}}],
+            },
+            {"$set": {
+                "consumer": consumer,
+                "partition": partition,
+                "owner": owner,
+                "lease_expires_at": now + timedelta(seconds=OUTBOX_LEASE_SECONDS),
+            }},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+    except DuplicateKeyError:
+        # The checkpoint exists but its filter did not match: the lease is held elsewhere
+        return None
+
+async def _run_outbox_worker(consumer: str, partition: int, owner: str = OUTBOX_OWNER):
+    """Consume one partition in _id order, checkpointing after each successfully handled batch.
+
+    Only the process holding the partition's lease (see _renew_outbox_lease) consumes it, so running several
+    server processes doesn't recompute the same month concurrently. The lease is renewed on every pass; a
+    batch whose handlers run longer than OUTBOX_LEASE_SECONDS can overlap with a new owner, so keep
+    OUTBOX_BATCH_SIZE small enough to handle well within it.
+
+    _id order is the order events were created, not committed. An event whose transaction commits more
+    than OUTBOX_SETTLE_SECONDS after its ObjectId was generated (a slow or retried commit, or clock skew
+    between the writing and consuming hosts) can land behind the checkpoint and is never delivered.
+    Writes keep that gap short (see _run_mutation); raise the settle window if lag allows it.
+    """
+    handler = OUTBOX_CONSUMERS[consumer]
+    checkpoint_id = f"{consumer}:{partition}"
+    # Handler failures are counted per batch, keyed by its first event, so database outages don't dead-letter
+    batch_head, attempts = None, 0
+    while True:
+        try:
+            checkpoint = await _renew_outbox_lease(checkpoint_id, consumer, partition, owner)
+            if not checkpoint:
+                await asyncio.sleep(OUTBOX_LEASE_SECONDS / 3)
+                continue
+            # Re-read every pass: a previous owner may have advanced the checkpoint
+            last_event_id = checkpoint.get("last_event_id")
+            # Events younger than the settle window may still be committing with a lower _id
+            id_range = {"$lt": ObjectId.from_datetime(datetime.utcnow() - timedelta(seconds=OUTBOX_SETTLE_SECONDS))}
+            if last_event_id:
+                id_range["$gt"] = last_event_id
+            batch = await db.events.find({"partition": partition, "_id": id_range}).sort(
+                "_id", 1
+            ).limit(OUTBOX_BATCH_SIZE).to_list(OUTBOX_BATCH_SIZE)
+            if not batch:
+                await asyncio.sleep(OUTBOX_POLL_SECONDS)
+                continue
+            if batch[0]["_id"] != batch_head:
+                batch_head, attempts = batch[0]["_id"], 0
+            dead_lettered = 0
+            if attempts >= OUTBOX_MAX_ATTEMPTS:
+                dead_lettered = await _dead_letter_failures(consumer, handler, batch)
+            else:
+                try:
+                    await handler(batch)
+                except Exception:
+                    attempts += 1
+                    raise
+            # A worker that lost its lease mid-batch must not move the checkpoint under the new owner
+            await db.outbox_checkpoints.update_one(
+                {"_id": checkpoint_id, "owner": owner},
+                {
+                    "$max": {"last_event_id": batch[-1]["_id"]},
+                    "$set": {"updated_at": datetime.utcnow()},
+                    "$inc": {"processed": len(batch), "dead_lettered": dead_lettered},
+                },
+            )
+        except asyncio.CancelledError:
+            # Hand the partition over on shutdown instead of making the next process wait out the lease
+            try:
+                await db.outbox_checkpoints.update_one(
+                    {"_id": checkpoint_id, "owner": owner}, {"$unset": {"owner": "", "lease_expires_at": ""}}
+                )
+            except Exception:
+                pass
+            raise
+        except Exception:
+            # The batch is retried from the last checkpoint, backing off while it keeps failing
+            logger.exception("Outbox consumer %s failed on partition %s", consumer, partition)
+            try:
+                await db.outbox_checkpoints.update_one(
+                    {"_id": checkpoint_id}, {"$inc": {"failures": 1}}, upsert=True
+                )
+            except Exception:
+                pass
+            await asyncio.sleep(min(OUTBOX_POLL_SECONDS * 2 ** attempts, OUTBOX_MAX_BACKOFF_SECONDS))
+
+async def _prune_outbox_events():
+    """Delete events that every registered consumer has checkpointed past and that are older than the retention period"""
+    while True:
+        try:
+            cutoff = ObjectId.from_datetime(datetime.utcnow() - timedelta(days=OUTBOX_RETENTION_DAYS))
+            for partition in range(OUTBOX_PARTITIONS):
+                checkpoints = [
+                    await db.outbox_checkpoints.find_one({"_id": f"{consumer}:{partition}"}) or {}
+                    for consumer in OUTBOX_CONSUMERS
+                ]
+                consumed = [checkpoint.get("last_event_id") for checkpoint in checkpoints]
+                if not consumed or None in consumed:
+                    continue
+                result = await db.events.delete_many(
+                    {"partition": partition, "_id": {"$lte": min(consumed), "$lt": cutoff}}
+                )
+                if result.deleted_count:
+                    logger.info("Pruned %s outbox events from partition %s", result.deleted_count, partition)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Outbox pruning failed")
+        await asyncio.sleep(OUTBOX_PRUNE_SECONDS)
+
+@api_router.get("/outbox/status")
+async def get_outbox_status():
+    now = datetime.utcnow()
+    workers = []
+    for consumer in OUTBOX_CONSUMERS:
+        for partition in range(OUTBOX_PARTITIONS):
+            checkpoint = await db.outbox_checkpoints.find_one({"_id": f"{consumer}:{partition}"}) or {}
+            pending_query = {"partition": partition}
+            if checkpoint.get("last_event_id"):
+                pending_query["_id"] = {"$gt": checkpoint["last_event_id"]}
+            oldest_pending = await db.events.find_one(pending_query, sort=[("_id", 1)])
+            lag_seconds = (now - oldest_pending["created_at"]).total_seconds() if oldest_pending else 0
+            workers.append({
+                "consumer": consumer,
+                "partition": partition,
+                "processed": checkpoint.get("processed", 0),
+                "failures": checkpoint.get("failures", 0),
+                "dead_lettered": checkpoint.get("dead_lettered", 0),
+                "pending": await db.events.count_documents(pending_query),
+                "lag_seconds": lag_seconds,
+                "last_checkpoint_at": checkpoint.get("updated_at"),
+                "owner": checkpoint.get("owner"),
+                "lease_expires_at": checkpoint.get("lease_expires_at"),
+            })
+    return {
+        "running": bool(_outbox_tasks),
+        "transactional": _supports_transactions,
+        "max_lag_seconds": max((worker["lag_seconds"] for worker in workers), default=0),
+        "dead_letter_pending": await db.events_dead_letter.count_documents({}),
+        "workers": workers,
+    }
+
+@api_router.get("/rollups/monthly")
+async def get_monthly_rollups(year: Optional[int] = None, portfolio_id: str = Depends(get_portfolio_id)):
+    query = {"portfolio_id": portfolio_id}
+    if year:
+        query["month"] = {"$gte": f"{year}-01", "$lte": f"{year}-12"}
+    return await db.monthly_rollups.find(query, {"_id": 0}).sort("month", 1).to_list(1200)
+
+# Partitioning: portfolio_id leads every index and every shard key, so each request stays in one partition
+SHARD_KEYS = {
+    "apartments": ["portfolio_id", "id"],
+    "tenants": ["portfolio_id", "id"],
+    "rent_payments": ["portfolio_id", "id"],
+    "expenses": ["portfolio_id", "id"],
+    "ledger_entries": ["portfolio_id", "tenant_id", "sequence"],
+    "tenant_balances": ["portfolio_id", "tenant_id"],
+    "monthly_rollups": ["portfolio_id", "month"],
+}
+INDEXES = [(collection, keys, True) for collection, keys in SHARD_KEYS.items()] + [
+    ("tenants", ["portfolio_id", "lease_end"], False),
+    ("rent_payments", ["portfolio_id", "due_date"], False),
+    ("rent_payments", ["portfolio_id", "paid_date"], False),
+    ("rent_payments", ["portfolio_id", "tenant_id"], False),
+    ("expenses", ["portfolio_id", "date"], False),
+    ("tenant_balances", ["portfolio_id", "balance"], False),
+    # Outbox events are read per worker partition rather than per portfolio
+    ("events", ["partition", "_id"], False),
+]
+
 # Include the router in the main app
 app.include_router(api_router)
 
@@ -417,6 +1438,36 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+@app.on_event("startup")
+async def create_indexes():
+    for collection, keys, unique in INDEXES:
+        await db[collection].create_index([(key, 1) for key in keys], unique=unique)
+
+async def detect_transactions() -> bool:
+    global _supports_transactions
+    # Multi-document transactions need a replica set or a sharded cluster
+    hello = await client.admin.command("hello")
+    _supports_transactions = "setName" in hello or hello.get("msg") == "isdbgrid"
+    return _supports_transactions
+
+@app.on_event("startup")
+async def start_outbox_workers():
+    await detect_transactions()
+    if OUTBOX_ENABLED and not _supports_transactions:
+        raise RuntimeError(
+            "The event outbox needs a replica set (a single-node one works: mongod --replSet rs0, then "
+            "rs.initiate()); set OUTBOX_ENABLED=false to run against a standalone mongod"
+        )
+    if OUTBOX_ENABLED:
+        for consumer in OUTBOX_CONSUMERS:
+            for partition in range(OUTBOX_PARTITIONS):
+                _outbox_tasks.append(asyncio.create_task(_run_outbox_worker(consumer, partition)))
+        _outbox_tasks.append(asyncio.create_task(_prune_outbox_events()))
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    for task in _outbox_tasks:
+        task.cancel()
+    await asyncio.gather(*_outbox_tasks, return_exceptions=True)
+    _outbox_tasks.clear()
     client.close()
\ No newline at end of file
@@ -6,7 +6,9 @@ Tests all backend endpoints for the property management application
 
 import requests
 import json
+import os
 import sys
+import time
 from datetime import datetime, date
 from typing import Dict, Any, Optional
 
@@ -14,6 +16,7 @@ class PropertyManagementAPITester:
     def __init__(self, base_url: str = "https://18ddf004-c98d-4856-a941-a3c58613f316.preview.emergentagent.com"):
         self.base_url = base_url
         self.api_url = f"{base_url}/api"
+        self.portfolio_id = "api-test"
         self.tests_run = 0
         self.tests_passed = 0
         self.created_resources = {
@@ -32,10 +35,14 @@ class PropertyManagementAPITester:
         else:
             print(f"❌ {name} - FAILED {details}")
 
-    def make_request(self, method: str, endpoint: str, data: Optional[Dict] = None) -> tuple[bool, Dict[str, Any], int]:
+    def make_request(self, method: str, endpoint: str, data: Optional[Dict] = None, portfolio_id: Optional[str] = None) -> tuple[bool, Dict[str, Any], int]:
         """Make HTTP request and return success, response data, status code"""
         url = f"{self.api_url}/{endpoint}"
         headers = {'Content-Type': 'application/json'}
+        if portfolio_id is None:
+            portfolio_id = self.portfolio_id
+        if portfolio_id:
+            headers['X-Portfolio-ID'] = portfolio_id
         
         try:
             if method == 'GET':
@@ -231,6 +238,58 @@ class PropertyManagementAPITester:
         payment_count = len(data) if isinstance(data, list) else 0
         self.log_test("GET /api/rent-payments (with data)", success, f"Found {payment_count} payments")
 
+    def test_tenant_ledger(self):
+        """Test tenant ledger and balance endpoints"""
+        print("\n📒 Testing Tenant Ledger...")
+        
+        if not self.created_resources['tenants'] or not self.created_resources['apartments']:
+            self.log_test("Tenant ledger", False, "No tenants or apartments available for testing")
+            return
+        
+        tenant_id = self.created_resources['tenants'][0]
+        success, before, status = self.make_request('GET', f'tenants/{tenant_id}/ledger')
+        self.log_test(f"GET /api/tenants/{tenant_id}/ledger", success, f"Status: {status}")
+        owed_before = before.get('balance', {}).get('balance', 0) if success else 0
+        
+        payment_data = {
+            "tenant_id": tenant_id,
+            "apartment_id": self.created_resources['apartments'][0],
+            "amount": 1500.00,
+            "due_date": "2024-03-01",
+            "paid_date": "2024-03-05",
+            "status": "partial",
+            "amount_paid": 500.00
+        }
+        success, data, status = self.make_request('POST', 'rent-payments', payment_data)
+        self.log_test("POST /api/rent-payments (partial)", success and data.get('amount_paid') == 500.0, f"Status: {status}")
+        if success and 'id' in data:
+            self.created_resources['rent_payments'].append(data['id'])
+        
+        invalid_payment = dict(payment_data, status="paid", amount_paid=0)
+        success, _, status = self.make_request('POST', 'rent-payments', invalid_payment)
+        self.log_test("POST /api/rent-payments (paid with amount_paid=0 rejected)", status == 422, f"Status: {status}")
+        invalid_payment = dict(payment_data, amount_paid=-1)
+        success, _, status = self.make_request('POST', 'rent-payments', invalid_payment)
+        self.log_test("POST /api/rent-payments (negative amount_paid rejected)", status == 422, f"Status: {status}")
+        invalid_payment = {key: value for key, value in payment_data.items() if key != "amount_paid"}
+        success, _, status = self.make_request('POST', 'rent-payments', invalid_payment)
+        self.log_test("POST /api/rent-payments (partial without amount_paid rejected)", status == 422, f"Status: {status}")
+        invalid_payment = dict(payment_data, amount_paid=0)
+        success, _, status = self.make_request('POST', 'rent-payments', invalid_payment)
+        self.log_test("POST /api/rent-payments (partial with amount_paid=0 rejected)", status == 422, f"Status: {status}")
+        
+        success, data, status = self.make_request('GET', f'tenants/{tenant_id}/ledger?limit=2')
+        if success and isinstance(data, dict):
+            owed_after = data['balance']['balance']
+            self.log_test("Ledger balance reflects partial payment", abs(owed_after - owed_before - 1000.0) < 0.01, f"Owed: {owed_before} -> {owed_after}")
+            self.log_test("Ledger pagination", len(data['entries']) <= 2, f"Entries: {len(data['entries'])}")
+        else:
+            self.log_test("Ledger after partial payment", False, f"Status: {status}")
+        
+        success, data, status = self.make_request('GET', 'tenants/balances?min_owed=1')
+        found = success and any(balance['tenant_id'] == tenant_id for balance in data)
+        self.log_test("GET /api/tenants/balances?min_owed=1", found, f"Status: {status}")
+
     def test_financial_reports(self):
         """Test financial reporting endpoints"""
         print("\n📊 Testing Financial Reports...")
@@ -256,6 +315,127 @@ class PropertyManagementAPITester:
             has_all_fields = all(field in data for field in expected_fields)
             self.log_test("Yearly report structure", has_all_fields, f"Fields present: {list(data.keys())}")
 
+    def test_analytics(self):
+        """Test cash-flow analytics endpoint"""
+        print("\n📉 Testing Analytics...")
+        
+        # Seed a fresh portfolio so the expected buckets are exact
+        portfolio_id = f"analytics-{datetime.now().strftime('%H%M%S')}"
+        tenant_data = {
+            "first_name": "Analytics",
+            "last_name": "Tenant",
+            "email": "analytics@example.com",
+            "phone": "555-0100",
+            "lease_start": "2023-01-01",
+            "lease_end": "2023-12-31",
+            "monthly_rent": 1000.00,
+            "deposit_paid": 1000.00
+        }
+        success, tenant, status = self.make_request('POST', 'tenants', tenant_data, portfolio_id=portfolio_id)
+        self.log_test("POST /api/tenants (analytics portfolio)", success, f"Status: {status}")
+        if not success:
+            return
+        payment_data = {
+            "tenant_id": tenant['id'],
+            "apartment_id": "analytics-apartment",
+            "amount": 1000.00,
+            "due_date": "2023-03-01",
+            "paid_date": "2023-04-02",
+            "status": "paid"
+        }
+        success, _, status = self.make_request('POST', 'rent-payments', payment_data, portfolio_id=portfolio_id)
+        self.log_test("POST /api/rent-payments (analytics portfolio)", success, f"Status: {status}")
+        expense_data = {
+            "expense_type": "insurance",
+            "amount": 250.00,
+            "description": "Analytics test expense",
+            "date": "2023-03-15"
+        }
+        success, expense, status = self.make_request('POST', 'expenses', expense_data, portfolio_id=portfolio_id)
+        self.log_test("POST /api/expenses (analytics portfolio)", success, f"Status: {status}")
+        
+        success, data, status = self.make_request('GET', 'analytics?start_year=2023&end_year=2023&forecast_months=6', portfolio_id=portfolio_id)
+        self.log_test("GET /api/analytics", success, f"Status: {status}")
+        
+        if success and isinstance(data, dict):
+            expected_fields = ['total_rental_income', 'total_expenses', 'net_cash_flow', 'collection_rate', 'expense_breakdown', 'monthly_cash_flow', 'rent_projection']
+            has_all_fields = all(field in data for field in expected_fields)
+            self.log_test("Analytics structure", has_all_fields, f"Fields present: {list(data.keys())}")
+            months = {row['month']: row for row in data.get('monthly_cash_flow', [])}
+            self.log_test("Analytics monthly buckets", len(months) == 12, f"Months: {len(months)}")
+            self.log_test("Analytics rent projection", len(data.get('rent_projection', [])) == 6, f"Months: {len(data.get('rent_projection', []))}")
+            
+            march, april = months.get('2023-03', {}), months.get('2023-04', {})
+            self.log_test("Payment billed and collected in due month", march.get('billed') == 1000.0 and march.get('collected') == 1000.0, f"March: {march}")
+            self.log_test("Payment income in paid month", april.get('rental_income') == 1000.0 and march.get('rental_income') == 0.0, f"April income: {april.get('rental_income')}")
+            self.log_test("Expense in its month and type", march.get('expenses') == 250.0 and march.get('expense_breakdown', {}).get('insurance') == 250.0, f"March breakdown: {march.get('expense_breakdown')}")
+            self.log_test("Analytics totals", data['total_rental_income'] == 1000.0 and data['expense_breakdown'].get('insurance') == 250.0, f"Income: {data['total_rental_income']}")
+        
+        success, data, status = self.make_request('GET', 'analytics?start_year=2024&end_year=2023', portfolio_id=portfolio_id)
+        self.log_test("GET /api/analytics (invalid range)", status == 400, f"Status: {status}")
+        
+        if expense and 'id' in expense:
+            self.make_request('DELETE', f"expenses/{expense['id']}", portfolio_id=portfolio_id)
+        self.make_request('DELETE', f"tenants/{tenant['id']}", portfolio_id=portfolio_id)
+
+    def test_archive(self):
+        """Test closed-year archive endpoints"""
+        print("\n🗄️ Testing Year Archive...")
+        
+        success, data, status = self.make_request('GET', 'archive')
+        self.log_test("GET /api/archive", success and isinstance(data, list), f"Closed years: {data}")
+        
+        current_year = datetime.now().year
+        success, data, status = self.make_request('POST', f'archive/{current_year}/close')
+        self.log_test(f"POST /api/archive/{current_year}/close (open year rejected)", status == 400, f"Status: {status}")
+
+        portfolio_id = f"archive-{datetime.now().strftime('%H%M%S')}"
+        tenant_data = {
+            "first_name": "Archive",
+            "last_name": "Tenant",
+            "email": "archive@test.com",
+            "phone": "555-0101",
+            "lease_start": "2001-01-01",
+            "lease_end": "2001-12-31",
+            "monthly_rent": 1000.00,
+            "deposit_paid": 1000.00
+        }
+        success, tenant, status = self.make_request('POST', 'tenants', tenant_data, portfolio_id=portfolio_id)
+        payment_data = {
+            "tenant_id": tenant.get('id'),
+            "apartment_id": "archive-apartment",
+            "amount": 1000.00,
+            "due_date": "2001-03-01",
+            "status": "unpaid"
+        }
+        success, payment, status = self.make_request('POST', 'rent-payments', payment_data, portfolio_id=portfolio_id)
+        self.log_test("POST /api/rent-payments (unpaid, closed year to be)", success, f"Status: {status}")
+
+        success, data, status = self.make_request('POST', 'archive/2001/close?prune=true', portfolio_id=portfolio_id)
+        self.log_test("POST /api/archive/2001/close?prune=true (fresh portfolio)", success, f"Status: {status}")
+
+        expense_data = {
+            "expense_type": "maintenance",
+            "amount": 50.0,
+            "description": "Closed year expense",
+            "date": "2001-06-01"
+        }
+        success, data, status = self.make_request('POST', 'expenses', expense_data, portfolio_id=portfolio_id)
+        self.log_test("POST /api/expenses (closed year rejected)", status == 409, f"Status: {status}")
+
+        if payment.get('id'):
+            rebill = {**payment_data, "amount": 1200.00}
+            success, data, status = self.make_request('PUT', f"rent-payments/{payment['id']}", rebill, portfolio_id=portfolio_id)
+            self.log_test("PUT /api/rent-payments (rebilling closed year rejected)", status == 409, f"Status: {status}")
+
+            settlement = {**payment_data, "status": "paid", "paid_date": "2024-01-05"}
+            success, data, status = self.make_request('PUT', f"rent-payments/{payment['id']}", settlement, portfolio_id=portfolio_id)
+            self.log_test("PUT /api/rent-payments (settling open balance from closed year)", success, f"Status: {status}")
+
+            success, data, status = self.make_request('GET', f"tenants/{tenant['id']}/ledger", portfolio_id=portfolio_id)
+            balance = data.get('balance', {}).get('balance') if success else None
+            self.log_test("Ledger cleared after settlement", balance == 0, f"Balance: {balance}")
+
     def test_dashboard(self):
         """Test dashboard endpoint"""
         print("\n📈 Testing Dashboard...")
@@ -274,6 +454,74 @@ class PropertyManagementAPITester:
                 tenants_count = data['total_tenants']
                 self.log_test("Dashboard data consistency", True, f"Apartments: {apartments_count}, Tenants: {tenants_count}")
 
+    def test_outbox(self):
+        """Test that writes flow through the event outbox into derived rollups"""
+        print("\n📬 Testing Event Outbox...")
+        
+        success, data, status = self.make_request('GET', 'outbox/status')
+        if success and not data.get('running'):
+            print("⏭️  Outbox is disabled on this server (standalone MongoDB), skipping")
+            return
+        
+        portfolio_id = f"outbox-{datetime.now().strftime('%H%M%S')}"
+        expense_data = {
+            "expense_type": "utilities",
+            "amount": 123.45,
+            "description": "Outbox test expense",
+            "date": "2024-05-10"
+        }
+        success, data, status = self.make_request('POST', 'expenses', expense_data, portfolio_id=portfolio_id)
+        self.log_test("POST /api/expenses (outbox portfolio)", success, f"Status: {status}")
+        expense_id = data.get('id') if success else None
+        
+        rollup = None
+        for _ in range(20):
+            success, data, status = self.make_request('GET', 'rollups/monthly?year=2024', portfolio_id=portfolio_id)
+            rollup = next((row for row in data if row.get('month') == '2024-05'), None) if success else None
+            if rollup and abs(rollup['expenses'] - 123.45) < 0.01:
+                break
+            time.sleep(0.5)
+        self.log_test("Monthly rollup updated from outbox", bool(rollup) and abs(rollup['expenses'] - 123.45) < 0.01, f"Rollup: {rollup}")
+        
+        success, data, status = self.make_request('GET', 'outbox/status')
+        self.log_test("GET /api/outbox/status", success and 'workers' in data, f"Max lag: {data.get('max_lag_seconds') if success else status}s")
+        
+        if expense_id:
+            success, _, status = self.make_request('DELETE', f'expenses/{expense_id}', portfolio_id=portfolio_id)
+            self.log_test(f"DELETE outbox expense {expense_id}", success, f"Status: {status}")
+
+    def test_portfolio_isolation(self):
+        """Test that data is scoped to the requesting portfolio"""
+        print("\n🔒 Testing Portfolio Isolation...")
+        
+        other_portfolio = f"test-{datetime.now().strftime('%H%M%S')}"
+        success, data, status = self.make_request('GET', 'apartments', portfolio_id=other_portfolio)
+        self.log_test("GET /api/apartments (other portfolio)", success and data == [], f"Found: {len(data) if isinstance(data, list) else data}")
+        
+        if self.created_resources['apartments']:
+            apartment_id = self.created_resources['apartments'][0]
+            success, data, status = self.make_request('GET', f'apartments/{apartment_id}', portfolio_id=other_portfolio)
+            self.log_test("GET apartment from other portfolio", status == 404, f"Status: {status}")
+        
+        success, data, status = self.make_request('GET', 'dashboard', portfolio_id=other_portfolio)
+        self.log_test("Dashboard (other portfolio)", success and data.get('total_apartments') == 0, f"Status: {status}")
+        
+        success, data, status = self.make_request('GET', 'apartments', portfolio_id="../invalid")
+        self.log_test("Invalid portfolio id rejected", status == 400, f"Status: {status}")
+        
+        success, data, status = self.make_request('GET', 'apartments', portfolio_id="")
+        self.log_test("Missing portfolio header rejected", status == 400, f"Status: {status}")
+        
+        if self.created_resources['tenants']:
+            payment_data = {
+                "tenant_id": self.created_resources['tenants'][0],
+                "apartment_id": "other-apartment",
+                "amount": 100.00,
+                "due_date": "2024-03-01"
+            }
+            success, data, status = self.make_request('POST', 'rent-payments', payment_data, portfolio_id=other_portfolio)
+            self.log_test("Rent payment for tenant of other portfolio rejected", status == 400, f"Status: {status}")
+
     def test_cleanup(self):
         """Clean up created test resources"""
         print("\n🧹 Cleaning up test resources...")
@@ -311,8 +559,13 @@ class PropertyManagementAPITester:
             self.test_tenant_crud()
             self.test_expense_crud()
             self.test_rent_payment_crud()
+            self.test_tenant_ledger()
             self.test_financial_reports()
+            self.test_analytics()
+            self.test_archive()
             self.test_dashboard()
+            self.test_portfolio_isolation()
+            self.test_outbox()
             
             # Cleanup
             self.test_cleanup()
@@ -333,7 +586,9 @@ class PropertyManagementAPITester:
 
 def main():
     """Main test runner"""
-    tester = PropertyManagementAPITester()
+    # Base URL from argv or BACKEND_URL, e.g. python backend_test.py http://localhost:8001
+    base_url = sys.argv[1] if len(sys.argv) > 1 else os.environ.get("BACKEND_URL")
+    tester = PropertyManagementAPITester(base_url) if base_url else PropertyManagementAPITester()
     success = tester.run_all_tests()
     return 0 if success else 1
 
@@ -4,6 +4,9 @@ import axios from "axios";
 
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
 const API = `${BACKEND_URL}/api`;
+const PORTFOLIO_ID = process.env.REACT_APP_PORTFOLIO_ID || "default";
+
+axios.defaults.headers.common["X-Portfolio-ID"] = PORTFOLIO_ID;
 
 const PropertyManagementApp = () => {
   const [activeTab, setActiveTab] = useState('dashboard');
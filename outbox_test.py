@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+"""
+Event Outbox Testing Suite
+Runs the outbox workers against a local mongod: delivery, resume from checkpoint, redelivery,
+dead-lettering, redrive, pruning and partition leases
+
+    python outbox_test.py                                                   # throwaway mongod via pymongo_inmemory
+    OUTBOX_TEST_MONGO_URL=mongodb://localhost:27017 python outbox_test.py   # or a running one
+"""
+
+import asyncio
+import os
+import sys
+from datetime import datetime
+
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "outbox_test")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+
+from motor.motor_asyncio import AsyncIOMotorClient
+
+import server
+import redrive_outbox
+
+CONSUMER = "outbox_test_recorder"
+
+class OutboxTester:
+    def __init__(self, mongo_url: str):
+        self.mongo_url = mongo_url
+        self.tests_run = 0
+        self.tests_passed = 0
+        self.delivered = []
+        self.failing = {}
+        self.workers = []
+
+    def log_test(self, name: str, success: bool, details: str = ""):
+        """Log test results"""
+        self.tests_run += 1
+        if success:
+            self.tests_passed += 1
+            print(f"✅ {name} - PASSED {details}")
+        else:
+            print(f"❌ {name} - FAILED {details}")
+
+    def connect(self):
+        return AsyncIOMotorClient(self.mongo_url)
+
+    async def record(self, events):
+        """Test consumer: fails on entity ids listed in self.failing (a count, or None for always)"""
+        for event in events:
+            remaining = self.failing.get(event["entity_id"], 0)
+            if remaining is None or remaining > 0:
+                if remaining:
+                    self.failing[event["entity_id"]] = remaining - 1
+                raise RuntimeError(f"failing {event['entity_id']}")
+        self.delivered.extend(event["entity_id"] for event in events)
+
+    async def append(self, entity_id: str, *documents, entity: str = "expense"):
+        # Events are appended outside a transaction here; the test exercises the consumer side only
+        await server._append_event(None, "outbox-test", entity, entity_id, "created", *documents)
+
+    def start_workers(self):
+        self.workers = [
+            asyncio.create_task(server._run_outbox_worker(consumer, 0)) for consumer in server.OUTBOX_CONSUMERS
+        ]
+
+    async def stop_workers(self):
+        for task in self.workers:
+            task.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        self.workers = []
+
+    async def wait_for(self, condition, timeout: float = 10):
+        deadline = asyncio.get_running_loop().time() + timeout
+        while asyncio.get_running_loop().time() < deadline:
+            if await condition():
+                return True
+            await asyncio.sleep(0.05)
+        return False
+
+    async def checkpoint(self, consumer: str = CONSUMER) -> dict:
+        return await server.db.outbox_checkpoints.find_one({"_id": f"{consumer}:0"}) or {}
+
+    async def test_delivery(self):
+        """Test that events reach every consumer and the rollup consumer recomputes the month"""
+        print("\n📬 Testing Delivery...")
+        expense = {"id": "expense-1", "portfolio_id": "outbox-test", "amount": 80.0, "date": "2024-05-10"}
+        await server.db.expenses.insert_one(dict(expense))
+        await self.append("expense-1", expense)
+        await self.append("expense-2")
+        self.start_workers()
+
+        async def delivered():
+            return self.delivered == ["expense-1", "expense-2"]
+        self.log_test("Events delivered in order", await self.wait_for(delivered), f"Delivered: {self.delivered}")
+
+        async def rolled_up():
+            rollup = await server.db.monthly_rollups.find_one({"portfolio_id": "outbox-test", "month": "2024-05"})
+            return rollup and rollup["expenses"] == 80.0
+        self.log_test("Monthly rollup recomputed", await self.wait_for(rolled_up))
+
+    async def test_resume(self):
+        """Test that a restarted worker resumes after its checkpoint without redelivering"""
+        print("\n🔁 Testing Resume From Checkpoint...")
+
+        async def checkpointed():
+            return (await self.checkpoint()).get("processed") == 2
+        await self.wait_for(checkpointed)
+        await self.stop_workers()
+        await self.append("expense-3")
+        self.start_workers()
+
+        async def resumed():
+            return "expense-3" in self.delivered
+        await self.wait_for(resumed)
+        self.log_test("Resumed without redelivery", self.delivered == ["expense-1", "expense-2", "expense-3"],
+                      f"Delivered: {self.delivered}")
+
+    async def test_redelivery(self):
+        """Test that a batch whose handler fails is redelivered from the checkpoint"""
+        print("\n♻️ Testing Redelivery...")
+        self.failing["expense-4"] = 1
+        await self.append("expense-4")
+
+        async def redelivered():
+            return "expense-4" in self.delivered
+        self.log_test("Failed batch redelivered", await self.wait_for(redelivered), f"Delivered: {self.delivered}")
+        checkpoint = await self.checkpoint()
+        self.log_test("Failure recorded on checkpoint", checkpoint.get("failures", 0) >= 1,
+                      f"Failures: {checkpoint.get('failures')}")
+
+    async def test_dead_letter(self):
+        """Test that an event that keeps failing is dead-lettered without holding back the partition"""
+        print("\n🪦 Testing Dead Letter...")
+        self.failing["poison"] = None
+        await self.append("poison")
+        await self.append("expense-5")
+
+        async def moved_on():
+            return "expense-5" in self.delivered
+        self.log_test("Partition moves past poison event", await self.wait_for(moved_on), f"Delivered: {self.delivered}")
+        parked = await server.db.events_dead_letter.find_one({"_id.consumer": CONSUMER})
+        self.log_test("Poison event dead-lettered", bool(parked) and parked["event"]["entity_id"] == "poison")
+
+        del self.failing["poison"]
+        await redrive_outbox.redrive(CONSUMER, False)
+        remaining = await server.db.events_dead_letter.count_documents({"_id.consumer": CONSUMER})
+        self.log_test("Redrive replays dead-lettered event", remaining == 0 and "poison" in self.delivered,
+                      f"Remaining: {remaining}")
+
+    async def test_prune(self):
+        """Test that pruning deletes only events every consumer has checkpointed past"""
+        print("\n🧹 Testing Pruning...")
+
+        async def caught_up():
+            checkpoints = [await self.checkpoint(consumer) for consumer in server.OUTBOX_CONSUMERS]
+            return all(checkpoint.get("processed") == 6 for checkpoint in checkpoints)
+        await self.wait_for(caught_up)
+        await self.stop_workers()
+        await self.append("unconsumed")
+
+        server.OUTBOX_RETENTION_DAYS = 0
+        pruner = asyncio.create_task(server._prune_outbox_events())
+
+        async def pruned():
+            return await server.db.events.count_documents({}) == 1
+        await self.wait_for(pruned, timeout=3)
+        pruner.cancel()
+        await asyncio.gather(pruner, return_exceptions=True)
+        remaining = [event["entity_id"] for event in await server.db.events.find().to_list(100)]
+        self.log_test("Only consumed events pruned", remaining == ["unconsumed"], f"Remaining: {remaining}")
+
+    async def test_lease(self):
+        """Test that a partition is consumed by one process at a time and handed over on shutdown"""
+        print("\n🔒 Testing Partition Lease...")
+        self.start_workers()
+
+        async def leased(owner):
+            return (await self.checkpoint()).get("owner") == owner
+        await self.wait_for(lambda: leased(server.OUTBOX_OWNER))
+        standby = asyncio.create_task(server._run_outbox_worker(CONSUMER, 0, owner="standby-process"))
+        await self.append("leased")
+
+        async def delivered():
+            return "leased" in self.delivered
+        await self.wait_for(delivered)
+        await asyncio.sleep(0.3)
+        self.log_test("Leased partition delivered once", self.delivered.count("leased") == 1,
+                      f"Delivered: {self.delivered}")
+        self.log_test("Lease kept by its owner", await leased(server.OUTBOX_OWNER))
+
+        await self.stop_workers()
+        took_over = await self.wait_for(lambda: leased("standby-process"))
+        await self.append("handed-over")
+
+        async def handed_over():
+            return "handed-over" in self.delivered
+        took_over = took_over and await self.wait_for(handed_over)
+        standby.cancel()
+        await asyncio.gather(standby, return_exceptions=True)
+        self.log_test("Standby takes over released lease", took_over and self.delivered.count("leased") == 1,
+                      f"Delivered: {self.delivered}")
+
+    async def run_all_tests(self):
+        """Run all outbox tests"""
+        print("🚀 Starting Event Outbox Tests")
+        print("=" * 60)
+
+        client = self.connect()
+        db_name = f"outbox_test_{datetime.now().strftime('%H%M%S')}"
+        server.client, server.db = client, client[db_name]
+        redrive_outbox.db = server.db
+        server._supports_transactions = True
+        server.OUTBOX_PARTITIONS = 1
+        server.OUTBOX_SETTLE_SECONDS = 0
+        server.OUTBOX_POLL_SECONDS = 0.05
+        server.OUTBOX_MAX_BACKOFF_SECONDS = 0.1
+        server.OUTBOX_MAX_ATTEMPTS = 2
+        server.OUTBOX_PRUNE_SECONDS = 0.1
+        server.OUTBOX_LEASE_SECONDS = 1
+        server.outbox_consumer(CONSUMER)(self.record)
+
+        try:
+            await server.create_indexes()
+            await self.test_delivery()
+            await self.test_resume()
+            await self.test_redelivery()
+            await self.test_dead_letter()
+            await self.test_prune()
+            await self.test_lease()
+        except Exception as e:
+            print(f"❌ Test suite failed with error: {str(e)}")
+            return False
+        finally:
+            await self.stop_workers()
+            await client.drop_database(db_name)
+            server.OUTBOX_CONSUMERS.pop(CONSUMER, None)
+
+        print("\n" + "=" * 60)
+        print(f"📊 TEST SUMMARY")
+        print(f"Tests Run: {self.tests_run}")
+        print(f"Tests Passed: {self.tests_passed}")
+        print(f"Tests Failed: {self.tests_run - self.tests_passed}")
+
+        return self.tests_passed == self.tests_run
+
+def main():
+    """Main test runner"""
+    mongo_url = os.environ.get("OUTBOX_TEST_MONGO_URL")
+    if mongo_url:
+        success = asyncio.run(OutboxTester(mongo_url).run_all_tests())
+    else:
+        from pymongo_inmemory import Mongod
+        with Mongod(None) as mongod:
+            success = asyncio.run(OutboxTester(mongod.connection_string).run_all_tests())
+    return 0 if success else 1
+
+if __name__ == "__main__":
+    sys.exit(main())